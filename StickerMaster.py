@@ -1,62 +1,231 @@
+import time
+
+STARTUP_TIME = time.perf_counter()  # Відлік часу запуску - до імпорту Qt
+
 import sys
 import os
-import fitz  # PyMuPDF
-import re
+import logging
+import multiprocessing
+from bisect import bisect
+from collections import OrderedDict
 from PySide6.QtWidgets import QApplication, QWidget, QLabel, QLineEdit, QPushButton, QFileDialog, \
-    QMessageBox, QGroupBox, QGridLayout, QTabWidget, QComboBox, QCheckBox
-from PySide6.QtGui import QPixmap, Qt
-from PIL import ImageQt, Image
+    QMessageBox, QGroupBox, QGridLayout, QTabWidget, QComboBox, QCheckBox, QProgressBar, QSizePolicy
+from PySide6.QtGui import QImage, QPixmap, Qt
+from PySide6.QtCore import QObject, QThread, QTimer, Signal, QFileSystemWatcher
+# PyMuPDF і sticker_engine імпортуються при першому використанні, щоб вікно з'являлося швидше
+from sticker_catalog import KIND_STANDARD, KIND_BOX, KIND_SPECIAL_BOX, DEFAULT_CHUNK_SIZE, DEFAULT_SAVE_PROFILE, \
+    load_template_listing, box_kind, standard_output_name, box_output_name, standard_fields, box_fields, \
+    special_box_fields, THUMBNAIL_DIR_NAME, HASH_INDEX_NAME, load_hash_index, save_hash_index, cached_file_hash, \
+    configure_logging, DEFAULT_RASTER_DPI, DEFAULT_RASTER_MODE, parse_serial_selection, reprint_output_name
+
+IMPORTS_DONE_TIME = time.perf_counter()
+
+logger = logging.getLogger("StickerMaster")
+
+PREVIEW_ZOOM = 3  # Найбільший масштаб прев'ю (логічних пікселів на пункт PDF)
+PREVIEW_SLOT_STEP = 50  # Крок розміру області прев'ю, px: дрібні зміни вікна не перерендерюють сторінку
+PREVIEW_MIN_SIZE = 300  # Найменша ширина й висота області прев'ю, px
+PREVIEW_RESIZE_DELAY = 200  # мс після останньої зміни розміру вікна до перемальовування прев'ю
+PREVIEW_CACHE_SIZE = 32  # Скільки готових прев'ю тримати в пам'яті
+THUMBNAIL_CACHE_SIZE = 32  # Скільки прев'ю шаблонів тримати в пам'яті
+LIVE_PREVIEW_DELAY = 300  # мс після останньої зміни поля до оновлення прев'ю
+TEMPLATE_RELOAD_DELAY = 500  # мс: копіювання PDF на спільний диск дає кілька подій поспіль
+
+
+class GenerationWorker(QObject):
+    # Виконує job(progress) у фоновому потоці і передає прогрес у вікно;
+    # з with_log - job(progress, log), де log(повідомлення) показується в рядку стану
+    progress = Signal(int, int, float, float)  # готово сторінок, всього, сторінок/с, залишилось секунд
+    message = Signal(str)
+    finished = Signal(str)
+    cancelled = Signal()
+    failed = Signal(str)
+
+    def __init__(self, job, with_log=False):
+        super().__init__()
+        self.job = job
+        self.with_log = with_log
+        self.is_cancelled = False
+        self.start_time = 0
+        self.last_report = 0
+
+    def cancel(self):
+        self.is_cancelled = True
+
+    def report(self, done, total):
+        if self.is_cancelled:
+            from sticker_engine import GenerationCancelled
+            raise GenerationCancelled()
+        now = time.perf_counter()
+        if done < total and now - self.last_report < 0.1:  # Не частіше 10 разів на секунду
+            return
+        self.last_report = now
+        rate = done / max(now - self.start_time, 1e-6)
+        self.progress.emit(done, total, rate, (total - done) / rate if rate else 0)
 
+    def log(self, message):
+        self.message.emit(message)
 
-class StickerGeneratorApp(QWidget):
-    def __init__(self):
+    def run(self):
+        from sticker_engine import GenerationCancelled
+        self.start_time = time.perf_counter()
+        try:
+            output_pdf = self.job(self.report, self.log) if self.with_log else self.job(self.report)
+        except GenerationCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished.emit(output_pdf)
 
-        self.font_mapping = {
-            "MyriadPro-Regular": "fonts/MyriadPro-Regular.ttf",
-            "MyriadPro-Bold": "fonts/MyriadPro-Bold.ttf",
-            "Arial-BoldMT": "fonts/arial-mt-bold.ttf",
-            "YVUNJSå¼«Arial-BoldMT": "fonts/4068-font.ttf",  #
-            "ArialMT": "fonts/ArialMT-Light.ttf",
-            "Bahnschrift": "fonts/bahnschrift.ttf",
-            "STGONDå¼«Bahnschrift": "fonts/bahnschrift.ttf",
-            "JIZLJBå¼«Bahnschrift": "fonts/bahnschrift.ttf",
-            "RHTNZFå¼«Bahnschrift": "fonts/bahnschrift.ttf",
-            "WHCMRVå¼«Bahnschrift": "fonts/bahnschrift.ttf",
-            "IMEGDXå¼«Bahnschrift": "fonts/bahnschrift.ttf",
-            "MyriadPro-SemiboldCond": "fonts/MyriadPro-SemiboldCond.otf",
-            "MyriadPro-BlackSemiExt": "fonts/Myriad Pro Black SemiExtended.otf",
-            "MyanmarText-Bold": "fonts/Myanmar Text Bold.TTF",
-            "MinionPro-Bold": "fonts/Minion Pro Bold.ttf",
-            "RJWHAAå¼«MyriadPro-Semib": "fonts/MyriadPro-SemiboldCond.otf",
-            "JFXDXWå¼«MyriadPro-Bold": "fonts/MyriadPro-Bold.ttf",
-            "LCJXNXå¼«MinionPro-Bold": "fonts/Minion Pro Bold.ttf",
-            "ZPRMHKå¼«MyriadPro-Regul": "fonts/MyriadPro-Regular.ttf",
-        }
 
+class StickerGeneratorApp(QWidget):
+    def __init__(self):
         super().__init__()
         self.templates_dir = "templates"  # Папка з шаблонами
+        self.chunk_size = DEFAULT_CHUNK_SIZE  # Стікерів на частину при записі довгих партій
         self.load_templates()
         self.initUI()
         self.template_pixmap = None
         self.preview_pixmap = None
+        self.preview_cache = OrderedDict()
+        self.thumbnail_cache = OrderedDict()
+        self.thumbnail_dir = os.path.join(self.templates_dir, THUMBNAIL_DIR_NAME)
+        self.thumbnail_index_path = os.path.join(self.thumbnail_dir, HASH_INDEX_NAME)
+        self.thumbnail_index = load_hash_index(self.thumbnail_index_path)
+        self.watch_templates()
+
+    def refresh_template_index(self, redraw_preview=False):
+        # Компілює лише нові та змінені шаблони (templates/.plans.json), решта береться з індексу.
+        # Виконується у фоновому потоці генерації: імпорт PyMuPDF і компіляція не блокують вікно,
+        # а прев'ю та генерація на цей час недоступні, як і під час звичайної генерації
+        if self.closing:
+            return  # Вікно вже закрите - потік не встиг би завершитися до виходу
+        if self.generation_thread is not None:
+            self.template_index_pending = True  # Після завершення генерації
+            return
+        templates_dir = self.templates_dir
+
+        def job(progress):
+            from sticker_engine import refresh_plan_index
+            return ", ".join(refresh_plan_index(templates_dir))
+
+        self.template_preview_pending = redraw_preview
+        self.start_generation(job, status="Перевірка шаблонів...", on_finished=self.on_template_index_refreshed,
+                              on_failed=self.on_template_index_failed)
+
+    def on_template_index_refreshed(self, compiled):
+        self.generation_status_label.clear()
+        if compiled:
+            logger.info("Скомпільовано шаблони: %s", compiled)
+        if self.template_preview_pending:
+            # Обраний шаблон змінився - прев'ю малюються після компіляції, коли потік звільнився
+            self.template_preview_pending = False
+            QTimer.singleShot(0, lambda: self.display_template_preview(self.template_path) if self.template_path
+                              else None)
+            self.schedule_live_preview()
+
+    def on_template_index_failed(self, message):
+        self.generation_status_label.clear()
+        logger.warning("Індекс шаблонів не оновлено: %s", message)
 
     def load_templates(self):
         self.standard_templates = {}
         self.box_templates = {}
 
         try:
-            for filename in os.listdir(self.templates_dir):
-                if filename.endswith(".pdf"):
-                    template_name = filename[:-4]  # Видаляємо розширення .pdf
-                    file_path = os.path.join(self.templates_dir, filename)
-                    if template_name.startswith("standard_"):  # Розрізняємо за префіксом
-                        self.standard_templates[template_name[9:]] = file_path  # Видаляємо префікс "standard_"
-                    elif template_name.startswith("box_"):
-                        self.box_templates[template_name[4:]] = file_path  # Видаляємо префікс "box_"
+            self.standard_templates, self.box_templates = load_template_listing(self.templates_dir)
         except FileNotFoundError:
             QMessageBox.critical(self, "Помилка", f"Папка з шаблонами '{self.templates_dir}' не знайдена!")
             return
 
+    def watch_templates(self):
+        # Папка шаблонів відстежується сповіщеннями системи (QFileSystemWatcher), без опитування:
+        # поки файли не змінюються, нічого не виконується. Папка - для нових, видалених і перейменованих
+        # PDF, самі файли - для перезапису на місці
+        self.template_stats = self.template_file_stats()
+        self.template_reload_pending = False
+        self.template_reload_timer = QTimer(self)
+        self.template_reload_timer.setSingleShot(True)
+        self.template_reload_timer.setInterval(TEMPLATE_RELOAD_DELAY)
+        self.template_reload_timer.timeout.connect(self.reload_templates)
+        self.template_watcher = QFileSystemWatcher(self)
+        self.template_watcher.directoryChanged.connect(lambda path: self.template_reload_timer.start())
+        self.template_watcher.fileChanged.connect(lambda path: self.template_reload_timer.start())
+        if os.path.isdir(self.templates_dir):
+            self.template_watcher.addPath(self.templates_dir)
+            self.watch_template_files()
+
+    def template_file_stats(self):
+        stats = {}
+        for path in list(self.standard_templates.values()) + list(self.box_templates.values()):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            stats[path] = (stat.st_mtime, stat.st_size)
+        return stats
+
+    def watch_template_files(self):
+        # Файл, замінений новим (видалення + запис), зникає зі списку спостереження - додаємо знову
+        watched = set(self.template_watcher.files())
+        missing = [path for path in self.template_stats if path not in watched]
+        if missing:
+            self.template_watcher.addPaths(missing)
+
+    def reload_templates(self):
+        # Оновлює лише те, що змінилось: пункти комбобоксів для нових і видалених PDF,
+        # кеші прев'ю та скомпільовані плани змінених; решта шаблонів не перечитується
+        if self.generation_thread is not None:
+            self.template_reload_pending = True  # Після завершення генерації
+            return
+        old_standard, old_box, old_stats = self.standard_templates, self.box_templates, self.template_stats
+        try:
+            self.standard_templates, self.box_templates = load_template_listing(self.templates_dir)
+        except OSError as e:
+            logger.warning("Error reloading templates: %s", e)  # Спільний диск тимчасово недоступний
+            return
+        self.template_stats = self.template_file_stats()
+        changed = [path for path, stat in self.template_stats.items() if old_stats.get(path, stat) != stat]
+        removed = [path for path in old_stats if path not in self.template_stats]
+        added = [path for path in self.template_stats if path not in old_stats]
+        self.watch_template_files()
+        if not (changed or removed or added):
+            return
+
+        self.update_template_combo(self.IME_standard_template_combo, old_standard, self.standard_templates)
+        self.update_template_combo(self.IME_box_template_combo, old_box, self.box_templates)
+        self.forget_templates(changed, removed)
+        self.refresh_template_index(redraw_preview=self.template_path in changed)
+
+    def update_template_combo(self, combo, old_templates, templates):
+        # Пункти, крім першого "- Шаблон не обрано -", відсортовані за алфавітом - як при створенні комбобоксу
+        for template_name in old_templates:
+            if template_name not in templates:
+                index = combo.findText(template_name)
+                if index < 0:
+                    continue  # Пункту вже немає, напр. шаблон перейменовано, поки оновлення чекало
+                if index == combo.currentIndex():
+                    combo.setCurrentIndex(0)  # Обраний шаблон видалено
+                combo.removeItem(index)
+        for template_name in sorted(templates):
+            if template_name not in old_templates and combo.findText(template_name) < 0:
+                names = [combo.itemText(index) for index in range(1, combo.count())]
+                combo.insertItem(1 + bisect(names, template_name), template_name)
+
+    def forget_templates(self, changed, removed):
+        from sticker_engine import forget_template_plan
+        for path in changed + removed:
+            forget_template_plan(path)
+            for key in [key for key in self.preview_cache if key[0] == path]:
+                del self.preview_cache[key]
+        # Прев'ю змінених шаблонів оновить template_thumbnail за новим хешем, видалених - прибираємо тут
+        for path in removed:
+            entry = self.thumbnail_index.pop(os.path.abspath(path), None)
+            if entry:
+                self.remove_thumbnails(entry["hash"])
+                save_hash_index(self.thumbnail_index_path, self.thumbnail_index)
+
     def initUI(self):
         main_layout = QGridLayout()  # Головний layout - QGridLayout
 
@@ -79,22 +248,108 @@ class StickerGeneratorApp(QWidget):
         main_layout.addWidget(self.tabs, 0, 0)  # row, col
         main_layout.setAlignment(self.tabs, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
 
-        # Створюємо області попереднього перегляду
+        # Прогрес фонової генерації
+        progress_layout = QGridLayout()
+        self.generation_progress_bar = QProgressBar()
+        self.generation_status_label = QLabel()
+        self.cancel_generation_button = QPushButton("Скасувати")
+        self.cancel_generation_button.clicked.connect(self.cancel_generation)
+        self.cancel_generation_button.setEnabled(False)
+        progress_layout.addWidget(self.generation_progress_bar, 0, 0)
+        progress_layout.addWidget(self.cancel_generation_button, 0, 1)
+        progress_layout.addWidget(self.generation_status_label, 1, 0, 1, 2)
+        self.batch_button = QPushButton("Пакет замовлень (CSV/JSON)...")
+        self.batch_button.clicked.connect(self.generate_batch_pdfs)
+        progress_layout.addWidget(self.batch_button, 2, 0, 1, 2)
+
+        # Профіль збереження: швидкість запису проти розміру файлу
+        self.save_profile_label = QLabel("Збереження PDF:")
+        self.save_profile_combo = QComboBox()
+        for profile, title in (("fast", "Швидко (для друку)"), ("balanced", "Збалансовано"),
+                               ("compact", "Компактно (архів, друкарня)")):
+            self.save_profile_combo.addItem(title, profile)
+        self.save_profile_combo.setCurrentIndex(self.save_profile_combo.findData(DEFAULT_SAVE_PROFILE))
+        progress_layout.addWidget(self.save_profile_label, 3, 0)
+        progress_layout.addWidget(self.save_profile_combo, 3, 1)
+
+        # Формат результату: PDF, растр (папка з PNG/TIFF на кожен стікер) або ZPL для етикеткових принтерів
+        self.output_format_label = QLabel("Формат:")
+        self.output_format_combo = QComboBox()
+        for title, output_format in (("PDF", (None, DEFAULT_RASTER_MODE)), ("PNG, 1 біт", ("png", "mono")),
+                                     ("PNG, відтінки сірого", ("png", "gray")), ("TIFF, 1 біт", ("tiff", "mono")),
+                                     ("TIFF, відтінки сірого", ("tiff", "gray")), ("ZPL (Zebra)", ("zpl", "mono"))):
+            self.output_format_combo.addItem(title, output_format)
+        self.raster_dpi_label = QLabel("DPI растра/принтера:")
+        self.raster_dpi_input = QLineEdit(str(DEFAULT_RASTER_DPI))
+        progress_layout.addWidget(self.output_format_label, 4, 0)
+        progress_layout.addWidget(self.output_format_combo, 4, 1)
+        progress_layout.addWidget(self.raster_dpi_label, 5, 0)
+        progress_layout.addWidget(self.raster_dpi_input, 5, 1)
+
+        # Розбиття партії на кілька PDF (для принтерів, яким важко з одним великим файлом)
+        self.split_size_label = QLabel("Стікерів у файлі:")
+        self.split_size_input = QLineEdit()
+        self.split_size_input.setPlaceholderText("усі в одному файлі")
+        self.split_size_input.setToolTip("Напр. 250 - файли по 250 стікерів, 1 - окремий PDF на кожен стікер; "
+                                         "файли зберігаються в папку з назвою замовлення")
+        progress_layout.addWidget(self.split_size_label, 6, 0)
+        progress_layout.addWidget(self.split_size_input, 6, 1)
+        main_layout.addLayout(progress_layout, 1, 0)
+        main_layout.setAlignment(progress_layout, Qt.AlignmentFlag.AlignTop)
+        self.generation_thread = None
+        self.generation_worker = None
+        self.generation_message = ""
+        self.template_index_pending = False
+        self.template_preview_pending = False
+        self.closing = False
+
+        # Живе прев'ю: оновлюється, коли оператор на мить перестає друкувати
+        self.live_preview_timer = QTimer(self)
+        self.live_preview_timer.setSingleShot(True)
+        self.live_preview_timer.setInterval(LIVE_PREVIEW_DELAY)
+        self.live_preview_timer.timeout.connect(self.refresh_live_preview)
+        self.live_preview_running = False
+        for line_edit in (self.prefix_IME_standard_input, self.short_prefix_IME_standard_input,
+                          self.art_seria_IME_standard_input, self.nominal_IME_standard_input,
+                          self.va_IME_standard_input, self.year_IME_standard_input, self.week_IME_standard_input,
+                          self.va_cl_02s_IME_standard_input, self.va_cl_02_IME_standard_input,
+                          self.va_cl_05s_IME_standard_input, self.seria_IME_box_input, self.art_seria_IME_box_input,
+                          self.nominal_IME_box_input, self.year_IME_box_input, self.week_IME_box_input):
+            line_edit.textChanged.connect(self.schedule_live_preview)
+        for checkbox in (self.add_3_checkbox, self.add_3_checkbox_box):
+            checkbox.toggled.connect(self.schedule_live_preview)
+        self.IME_standard_template_combo.currentIndexChanged.connect(self.schedule_live_preview)
+        self.IME_box_template_combo.currentIndexChanged.connect(self.schedule_live_preview)
+        self.tabs.currentChanged.connect(self.schedule_live_preview)
+
+        # Створюємо області попереднього перегляду. Їхній розмір задає layout (вільне місце праворуч від форми),
+        # а не картинка: масштаб прев'ю підбирається під область, тож вікно не розростається
         self.template_preview_label = QLabel()
         self.preview_preview_label = QLabel()
+        for label in (self.template_preview_label, self.preview_preview_label):
+            label.setSizePolicy(QSizePolicy.Policy.Ignored, QSizePolicy.Policy.Ignored)
+            label.setMinimumSize(PREVIEW_MIN_SIZE, PREVIEW_MIN_SIZE)
+            label.setAlignment(Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)  # Картинка зверху ліворуч
 
         # Додаємо області попереднього перегляду до головного layout
         main_layout.addWidget(self.template_preview_label, 0, 1)  # row, col
         main_layout.addWidget(self.preview_preview_label, 1, 1)  # row, col
+        main_layout.setColumnStretch(1, 1)
+        main_layout.setRowStretch(0, 1)
+        main_layout.setRowStretch(1, 1)
 
-        # Вирівнюємо області попереднього перегляду по верхньому лівому куту
-        main_layout.setAlignment(self.template_preview_label, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
-        main_layout.setAlignment(self.preview_preview_label, Qt.AlignmentFlag.AlignTop | Qt.AlignmentFlag.AlignLeft)
+        # Після зміни розміру вікна прев'ю перемальовуються під нову область
+        self.preview_resize_timer = QTimer(self)
+        self.preview_resize_timer.setSingleShot(True)
+        self.preview_resize_timer.setInterval(PREVIEW_RESIZE_DELAY)
+        self.preview_resize_timer.timeout.connect(self.redraw_previews)
+        self.preview_resize_pending = False
 
         self.setLayout(main_layout)
         self.setWindowTitle("Sticker Master IME")
+        available = (self.screen() or QApplication.primaryScreen()).availableGeometry()
+        self.resize(available.width() * 3 // 4, available.height() * 3 // 4)
         self.template_path = ""
-        self.temp_preview_path = ""
 
     def create_IME_standard_form_elements(self):
         self.IME_standard_template_label = QLabel("PDF-шаблон:")
@@ -140,10 +395,15 @@ class StickerGeneratorApp(QWidget):
 
         self.add_3_checkbox = QCheckBox("Додати 3 в кінці артикула")
 
-        self.generate_1_standard_sticker_button = QPushButton("Згенерувати 1 стікер")
+        self.workers_IME_standard_label = QLabel("Процесів:")
+        self.workers_IME_standard_input = QLineEdit("1")
+        self.workers_IME_standard_input.setToolTip("Більше 1 - партія генерується паралельно в кількох процесах")
+
+        self.generate_1_standard_sticker_button = QPushButton("Передрукувати номери")
         self.generate_1_standard_sticker_button.clicked.connect(self.generate_one_IME_standard_pdfs)
         self.generate_1_standard_sticker_input = QLineEdit()
-        self.generate_1_standard_sticker_input.setPlaceholderText("Всі 4 цифри номеру")
+        self.generate_1_standard_sticker_input.setPlaceholderText("Напр. 0412 або 0150-0300, 0977")
+        self.append_reprint_checkbox = QCheckBox("Дописати в кінець існуючого PDF замовлення")
 
         # Встановлюємо рамку для QLineEdit
         self.art_seria_IME_standard_input.setStyleSheet("QLineEdit { border: 1px solid gray; }")
@@ -157,6 +417,7 @@ class StickerGeneratorApp(QWidget):
         self.va_cl_02_IME_standard_input.setStyleSheet("QLineEdit { border: 1px solid gray; }")
         self.va_cl_05s_IME_standard_input.setStyleSheet("QLineEdit { border: 1px solid gray; }")
         self.generate_1_standard_sticker_input.setStyleSheet("QLineEdit { border: 1px solid gray; }")
+        self.workers_IME_standard_input.setStyleSheet("QLineEdit { border: 1px solid gray; }")
 
         self.generate_IME_standard_button = QPushButton("Згенерувати PDF")
         self.generate_IME_standard_button.clicked.connect(self.generate_IME_standard_pdfs)
@@ -269,6 +530,11 @@ class StickerGeneratorApp(QWidget):
         input_layout.addWidget(self.generate_1_standard_sticker_input, 15, 0)
         input_layout.addWidget(self.generate_1_standard_sticker_button, 15, 1)
 
+        input_layout.addWidget(self.append_reprint_checkbox, 16, 0, 1, 2)
+
+        input_layout.addWidget(self.workers_IME_standard_label, 17, 0)
+        input_layout.addWidget(self.workers_IME_standard_input, 17, 1)
+
         self.va_cl_02s_IME_standard_label.setVisible(False)
         self.va_cl_02s_IME_standard_input.setVisible(False)
         self.va_cl_02_IME_standard_label.setVisible(False)
@@ -357,7 +623,7 @@ class StickerGeneratorApp(QWidget):
             self.template_path = self.box_templates[selected_template]
             self.display_template_preview(self.template_path)
             # Додаємо визначення чи шаблон спецільний
-            self.is_box_special_template = selected_template.endswith("_box_special_1")
+            self.is_box_special_template = box_kind(selected_template) == KIND_SPECIAL_BOX
             self.add_3_checkbox_box.setVisible(self.is_box_special_template)
         else:
             self.template_path = ""
@@ -367,34 +633,139 @@ class StickerGeneratorApp(QWidget):
 
     def display_template_preview(self, file_path):
         try:
-            pixmap = self.pdf_to_pixmap(file_path)
+            pixmap = self.template_thumbnail(file_path)
             if pixmap:
                 self.template_pixmap = pixmap
                 self.template_preview_label.setPixmap(pixmap)  # Без масштабування
-                self.template_preview_label.resize(pixmap.size())  # Автоматичний розмір
         except Exception as e:
             QMessageBox.critical(self, "Помилка", f"Помилка завантаження прев'ю шаблону: {e}")
 
-    def pdf_to_pixmap(self, pdf_path):
+    def template_thumbnail(self, file_path):
+        # Прев'ю шаблону кешується в пам'яті та у templates/.thumbnails за хешем вмісту PDF;
+        # масштаб залежить від області прев'ю та екрана, тому їхні параметри теж входять у назву файлу
+        label = self.template_preview_label
+        width, height = self.preview_slot(label)
+        pixel_ratio = label.devicePixelRatioF()
+        content_hash, old_hash = cached_file_hash(file_path, self.thumbnail_index)
+        if old_hash:
+            self.remove_thumbnails(old_hash)
+        key = f"{content_hash}_{width}x{height}@{pixel_ratio:g}"
+
+        pixmap = self.thumbnail_cache.get(key)
+        if pixmap is not None:
+            self.thumbnail_cache.move_to_end(key)
+            return pixmap
+        thumbnail_path = os.path.join(self.thumbnail_dir, key + ".png")
+        pixmap = QPixmap(thumbnail_path)
+        if pixmap.isNull():
+            pixmap = self.pdf_to_pixmap(file_path, label)
+            if pixmap is None:
+                return None
+            if os.path.isdir(self.thumbnail_dir) or self.make_thumbnail_dir():
+                # На диску лишається одне прев'ю шаблону - для поточного розміру області
+                self.remove_thumbnail_files(content_hash)
+                pixmap.save(thumbnail_path, "PNG")
+                save_hash_index(self.thumbnail_index_path, self.thumbnail_index)
+        else:
+            pixmap.setDevicePixelRatio(pixel_ratio)
+        self.thumbnail_cache[key] = pixmap
+        if len(self.thumbnail_cache) > THUMBNAIL_CACHE_SIZE:
+            self.thumbnail_cache.popitem(last=False)
+        return pixmap
+
+    def make_thumbnail_dir(self):
+        try:
+            os.makedirs(self.thumbnail_dir, exist_ok=True)
+            return True
+        except OSError:
+            return False  # Папка шаблонів лише для читання - кеш тільки в пам'яті
+
+    def remove_thumbnails(self, content_hash):
+        # Шаблон змінився - старі прев'ю більше не знадобляться
+        for key in [key for key in self.thumbnail_cache if key.startswith(content_hash)]:
+            del self.thumbnail_cache[key]
+        self.remove_thumbnail_files(content_hash)
+
+    def remove_thumbnail_files(self, content_hash):
+        try:
+            for filename in os.listdir(self.thumbnail_dir):
+                if filename.startswith(content_hash):
+                    os.remove(os.path.join(self.thumbnail_dir, filename))
+        except OSError:
+            pass
+
+    def pdf_to_pixmap(self, pdf_path, label):
+        import fitz  # PyMuPDF
         try:
             doc = fitz.open(pdf_path)
-            page = doc[0]
-
-            # Змінюємо матрицю для збільшення розміру
-            matrix = fitz.Matrix(3, 3)  # Збільшення в 4 рази (400%)
-            pix = page.get_pixmap(matrix=matrix)
-
-            # Конвертуємо за допомогою Pillow (якщо потрібно)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            qimage = ImageQt.ImageQt(img)
-            pixmap = QPixmap.fromImage(qimage)
-
+            pixmap = self.page_to_pixmap(doc[0], label)
             doc.close()
             return pixmap
         except Exception as e:
-            print(f"Error converting PDF to pixmap: {e}")
+            logger.warning("Error converting PDF to pixmap: %s", e)
             return None
 
+    def preview_slot(self, label):
+        # Розмір області прев'ю, округлений вниз до PREVIEW_SLOT_STEP: сторінка ніколи не виходить за її межі,
+        # а кеші прев'ю не заповнюються варіантами для кожного пікселя при зміні розміру вікна
+        size = label.size()
+        return (max(size.width() // PREVIEW_SLOT_STEP, 1) * PREVIEW_SLOT_STEP,
+                max(size.height() // PREVIEW_SLOT_STEP, 1) * PREVIEW_SLOT_STEP)
+
+    def preview_zoom(self, page, label):
+        # Масштаб у логічних пікселях: сторінка вміщується в область прев'ю, але не більше PREVIEW_ZOOM;
+        # для HiDPI рендеримо з урахуванням devicePixelRatio
+        width, height = self.preview_slot(label)
+        zoom = min(PREVIEW_ZOOM, width / page.rect.width, height / page.rect.height)
+        return zoom, label.devicePixelRatioF()
+
+    def page_to_pixmap(self, page, label):
+        import fitz  # PyMuPDF
+
+        zoom, pixel_ratio = self.preview_zoom(page, label)
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom * pixel_ratio, zoom * pixel_ratio), alpha=False)
+
+        # QImage працює прямо з буфером PyMuPDF, без проміжних копій; fromImage робить єдину копію,
+        # тому pix має жити до кінця цієї функції
+        qimage = QImage(pix.samples_mv, pix.width, pix.height, pix.stride, QImage.Format.Format_RGB888)
+        pixmap = QPixmap.fromImage(qimage)
+        pixmap.setDevicePixelRatio(pixel_ratio)
+        return pixmap
+
+    def show_cached_preview(self, kind, fields):
+        # Готові прев'ю зберігаються в LRU-кеші за шаблоном (з його mtime) і значеннями полів,
+        # тож повернення до недавніх значень чи шаблонів не рендерить сторінку наново
+        try:
+            key = (self.template_path, os.path.getmtime(self.template_path), kind, tuple(sorted(fields.items())),
+                   self.preview_slot(self.preview_preview_label), self.preview_preview_label.devicePixelRatioF())
+            pixmap = self.preview_cache.get(key)
+            if pixmap is None:
+                pixmap = self.render_preview(kind, fields)
+                self.preview_cache[key] = pixmap
+                if len(self.preview_cache) > PREVIEW_CACHE_SIZE:
+                    self.preview_cache.popitem(last=False)
+            else:
+                self.preview_cache.move_to_end(key)
+            self.preview_pixmap = pixmap
+            self.preview_preview_label.setPixmap(pixmap)  # Без масштабування
+        except Exception as e:
+            if self.live_preview_running:
+                # Поля ще не заповнені до кінця - лишаємо попереднє прев'ю без діалогу
+                logger.debug("Прев'ю не оновлено: %s", e)
+            else:
+                QMessageBox.critical(self, "Помилка", f"Помилка генерації прев'ю: {e}")
+
+    def render_preview(self, kind, fields):
+        # Прев'ю малюється прямо зі згенерованої в пам'яті сторінки, без тимчасового файлу
+        import fitz  # PyMuPDF
+        from sticker_engine import get_template_plan, render_plan
+        doc_output = fitz.open()
+        try:
+            render_plan(get_template_plan(self.template_path, kind), doc_output, fields)
+            return self.page_to_pixmap(doc_output[0], self.preview_preview_label)
+        finally:
+            doc_output.close()
+
     def show_IME_standard_preview(self):
         if not self.template_path:
             return
@@ -406,34 +777,15 @@ class StickerGeneratorApp(QWidget):
         nominal = self.nominal_IME_standard_input.text()
         va = self.va_IME_standard_input.text()
 
-        self.temp_preview_path = os.path.join(os.getcwd(), "tmp_preview.pdf")
-        doc_output = fitz.open()
         if "special_1" in self.template_path:
             va_cl_02s = self.va_cl_02s_IME_standard_input.text()
             va_cl_02 = self.va_cl_02_IME_standard_input.text()
             va_cl_05s = self.va_cl_05s_IME_standard_input.text()
-            self.modify_IME_standart_pdf(self.template_path, doc_output, f"{prefix}0001", date_code, nominal,
-                                         va_cl_02s, short_prefix, va_cl_02, va_cl_05s)
-        else:
-            self.modify_IME_standart_pdf(self.template_path, doc_output, f"{prefix}0001", date_code, nominal, va,
-                                         short_prefix)
-        doc_output.save(self.temp_preview_path)
-        doc_output.close()
-
-        # Перевірка існування файлу
-        if os.path.exists(self.temp_preview_path):
-            print(f"Тимчасовий файл створено: {self.temp_preview_path}")  # Для дебагу
-            try:
-                pixmap = self.pdf_to_pixmap(self.temp_preview_path)
-                if pixmap:
-                    self.preview_pixmap = pixmap
-                    self.preview_preview_label.setPixmap(pixmap)  # Без масштабування
-                    self.preview_preview_label.resize(pixmap.size())  # Автоматичний розмір
-            except Exception as e:
-                QMessageBox.critical(self, "Помилка", f"Помилка генерації прев'ю: {e}")
+            fields = self.IME_standard_fields(f"{prefix}0001", date_code, nominal, va_cl_02s, short_prefix, va_cl_02,
+                                              va_cl_05s)
         else:
-            print("Помилка: Тимчасовий файл не створено!")  # Для дебагу
-            QMessageBox.critical(self, "Помилка", "Помилка створення тимчасового файлу прев'ю.")
+            fields = self.IME_standard_fields(f"{prefix}0001", date_code, nominal, va, short_prefix)
+        self.show_cached_preview(KIND_STANDARD, fields)
 
     def show_IME_box_preview(self):
         if not self.template_path:
@@ -444,34 +796,33 @@ class StickerGeneratorApp(QWidget):
         date_code = f"{year}W{week}"
         nominal = self.nominal_IME_box_input.text()
 
-        self.temp_preview_path = os.path.join(os.getcwd(), "tmp_preview.pdf")
-        doc_output = fitz.open()
         # Додаємо перевірку на спецільний шаблон
         if self.is_box_special_template:
-            self.modify_IME_special_box_pdf(self.template_path, doc_output, nominal, short_prefix)
+            self.show_cached_preview(KIND_SPECIAL_BOX, self.IME_special_box_fields(nominal, short_prefix))
         else:
-            self.modify_IME_box_pdf(self.template_path, doc_output, date_code, nominal, short_prefix)
-        doc_output.save(self.temp_preview_path)
-        doc_output.close()
+            self.show_cached_preview(KIND_BOX, self.IME_box_fields(date_code, nominal, short_prefix))
 
-        # Перевірка існування файлу
-        if os.path.exists(self.temp_preview_path):
-            print(f"Тимчасовий файл створено: {self.temp_preview_path}")  # Для дебагу
-            try:
-                pixmap = self.pdf_to_pixmap(self.temp_preview_path)
-                if pixmap:
-                    self.preview_pixmap = pixmap
-                    self.preview_preview_label.setPixmap(pixmap)  # Без масштабування
-                    self.preview_preview_label.resize(pixmap.size())  # Автоматичний розмір
-            except Exception as e:
-                QMessageBox.critical(self, "Помилка", f"Помилка генерації прев'ю: {e}")
-        else:
-            print("Помилка: Тимчасовий файл не створено!")  # Для дебагу
-            QMessageBox.critical(self, "Помилка", "Помилка створення тимчасового файлу прев'ю.")
+    def schedule_live_preview(self):
+        # Кожна зміна поля перезапускає таймер: під час швидкого набору рендериться лише останній варіант
+        self.live_preview_timer.start()
+
+    def refresh_live_preview(self):
+        if self.generation_thread is not None or not self.template_path:
+            return  # Під час генерації план шаблону зайнятий фоновим потоком
+        self.live_preview_running = True
+        try:
+            if self.tabs.currentWidget() is self.standard_tab:
+                if self.template_path in self.standard_templates.values():
+                    self.show_IME_standard_preview()
+            elif self.template_path in self.box_templates.values():
+                self.show_IME_box_preview()
+        finally:
+            self.live_preview_running = False
 
     def generate_IME_standard_pdfs(self):
         if not self.template_path:
             return
+        from sticker_engine import get_template_plan, write_standard_run, write_standard_run_parallel
 
         prefix = self.prefix_IME_standard_input.text()
         short_prefix = self.short_prefix_IME_standard_input.text()
@@ -487,30 +838,53 @@ class StickerGeneratorApp(QWidget):
             return
 
         # Формуємо назву файлу
-        output_pdf = os.path.join(folder, f"{short_prefix} {nominal}A {date_code}-{count}шт.pdf")
-        doc_output = fitz.open()  # Новий PDF документ для збереження всіх сторінок
+        output_pdf = os.path.join(folder, standard_output_name(short_prefix, nominal, date_code, count))
 
         if "special_1" in self.template_path:
             va_cl_02s = self.va_cl_02s_IME_standard_input.text()
             va_cl_02 = self.va_cl_02_IME_standard_input.text()
             va_cl_05s = self.va_cl_05s_IME_standard_input.text()
-            for i in range(1, count + 1):
-                serial_number = f"{prefix}{i:04}"
-                self.modify_IME_standart_pdf(self.template_path, doc_output, serial_number, date_code, nominal,
-                                             va_cl_02s, short_prefix, va_cl_02, va_cl_05s)
+            fields = self.IME_standard_fields(None, date_code, nominal, va_cl_02s, short_prefix, va_cl_02, va_cl_05s)
         else:
-            for i in range(1, count + 1):
-                serial_number = f"{prefix}{i:04}"
-                self.modify_IME_standart_pdf(self.template_path, doc_output, serial_number, date_code, nominal, va,
-                                             short_prefix)
-
-        # Зберегти фінальний PDF файл з усіма сторінками
-        doc_output.save(output_pdf)
-        doc_output.close()
+            fields = self.IME_standard_fields(None, date_code, nominal, va, short_prefix)
+
+        # Все, крім серійного номера, однакове для всіх стікерів: будуємо фон один раз,
+        # а на кожній сторінці лише накладаємо номер
+        template_path = self.template_path
+        serial_numbers = [f"{prefix}{i:04}" for i in range(1, count + 1)]
+        workers = int(self.workers_IME_standard_input.text() or 1)
+        save_profile = self.save_profile_combo.currentData()
+        output_format, raster_mode, dpi = self.output_settings()
+        split_size = self.split_size()
+        if split_size and not output_format:
+            # Файли по split_size стікерів пишуться паралельно в workers процесах
+            from sticker_batch import standard_split_files
+            files = standard_split_files(output_pdf, prefix, short_prefix, nominal, date_code, range(1, count + 1),
+                                         split_size)
+            self.start_split_generation(KIND_STANDARD, template_path, fields, files, workers, save_profile)
+        elif output_format:
+            # Растри або ZPL для етикеткових принтерів
+            from sticker_batch import write_printer_output
+            self.start_generation(lambda progress: write_printer_output(
+                KIND_STANDARD, template_path, fields, serial_numbers, count, output_pdf, output_format, dpi,
+                raster_mode, workers, progress))
+        elif workers > 1:
+            # Великі партії: діапазон номерів ділиться між процесами, частини зливаються по порядку
+            self.start_generation(lambda progress: write_standard_run_parallel(
+                template_path, fields, serial_numbers, output_pdf, workers, progress, save_profile=save_profile))
+        else:
+            # Довгі партії пишуться у файл частинами, щоб пам'ять не росла з кількістю стікерів
+            chunk_size = self.chunk_size if count > self.chunk_size else None
+            self.start_generation(lambda progress: write_standard_run(
+                get_template_plan(template_path, KIND_STANDARD), fields, serial_numbers, output_pdf, progress,
+                chunk_size, save_profile))
 
     def generate_one_IME_standard_pdfs(self):
+        # Передрук пошкоджених стікерів: генеруються лише вказані номери й діапазони
+        # в окремий файл або в кінець існуючого PDF замовлення
         if not self.template_path:
             return
+        from sticker_engine import get_template_plan, write_standard_run, append_standard_run
 
         prefix = self.prefix_IME_standard_input.text()
         short_prefix = self.short_prefix_IME_standard_input.text()
@@ -519,33 +893,58 @@ class StickerGeneratorApp(QWidget):
         date_code = f"{year}W{week}"
         nominal = self.nominal_IME_standard_input.text()
         va = self.va_IME_standard_input.text()
-        i = self.generate_1_standard_sticker_input.text()
-
-        folder = QFileDialog.getExistingDirectory(self, "Виберіть папку для збереження")
-        if not folder:
+        try:
+            numbers = parse_serial_selection(self.generate_1_standard_sticker_input.text())
+        except ValueError as e:
+            QMessageBox.warning(self, "Передрук", str(e))
+            return
+        output_format, raster_mode, dpi = self.output_settings()
+        append = self.append_reprint_checkbox.isChecked()
+        if append and output_format:
+            QMessageBox.warning(self, "Передрук", "Дописати в існуючий файл можна лише PDF")
             return
 
-        # Формуємо назву файлу
-        output_pdf = os.path.join(folder, f"{short_prefix} {nominal}A {date_code} #{i}-1шт.pdf")
-        doc_output = fitz.open()  # Новий PDF документ для збереження всіх сторінок
-        serial_number = f"{prefix}{i:04}"
+        if append:
+            output_pdf, _ = QFileDialog.getOpenFileName(self, "Виберіть PDF замовлення", "", "PDF (*.pdf)")
+            if not output_pdf:
+                return
+        else:
+            folder = QFileDialog.getExistingDirectory(self, "Виберіть папку для збереження")
+            if not folder:
+                return
+            # Формуємо назву файлу
+            output_pdf = os.path.join(folder, reprint_output_name(short_prefix, nominal, date_code, numbers))
+
         if "special_1" in self.template_path:
             va_cl_02s = self.va_cl_02s_IME_standard_input.text()
             va_cl_02 = self.va_cl_02_IME_standard_input.text()
             va_cl_05s = self.va_cl_05s_IME_standard_input.text()
-            self.modify_IME_standart_pdf(self.template_path, doc_output, serial_number, date_code, nominal,
-                                         va_cl_02s, short_prefix, va_cl_02, va_cl_05s)
+            fields = self.IME_standard_fields(None, date_code, nominal, va_cl_02s, short_prefix, va_cl_02, va_cl_05s)
         else:
-            self.modify_IME_standart_pdf(self.template_path, doc_output, serial_number, date_code, nominal, va,
-                                         short_prefix)
-
-        # Зберегти фінальний PDF файл з усіма сторінками
-        doc_output.save(output_pdf)
-        doc_output.close()
+            fields = self.IME_standard_fields(None, date_code, nominal, va, short_prefix)
+
+        template_path = self.template_path
+        serial_numbers = [f"{prefix}{i:04}" for i in numbers]
+        save_profile = self.save_profile_combo.currentData()
+        chunk_size = self.chunk_size if len(numbers) > self.chunk_size else None
+        if output_format:
+            from sticker_batch import write_printer_output
+            self.start_generation(lambda progress: write_printer_output(
+                KIND_STANDARD, template_path, fields, serial_numbers, len(numbers), output_pdf, output_format, dpi,
+                raster_mode, progress=progress))
+        elif append:
+            self.start_generation(lambda progress: append_standard_run(
+                get_template_plan(template_path, KIND_STANDARD), fields, serial_numbers, output_pdf, progress,
+                chunk_size, save_profile))
+        else:
+            self.start_generation(lambda progress: write_standard_run(
+                get_template_plan(template_path, KIND_STANDARD), fields, serial_numbers, output_pdf, progress,
+                chunk_size, save_profile))
 
     def generate_IME_box_pdfs(self):
         if not self.template_path:
             return
+        from sticker_engine import get_template_plan, write_box_run
         seria = self.seria_IME_box_input.text()
         count = int(self.box_count_IME_box_input.text())
         year = self.year_IME_box_input.text()
@@ -558,502 +957,236 @@ class StickerGeneratorApp(QWidget):
             return
 
         # Формуємо назву файлу
-        output_pdf = os.path.join(folder, f"{seria} {nominal}A {date_code}-КОРОБКА-{count}шт.pdf")
-        doc_output = fitz.open()  # Новий PDF документ для збереження всіх сторінок
+        output_pdf = os.path.join(folder, box_output_name(seria, nominal, date_code, count))
 
-        for i in range(1, count + 1):
-            # Додаємо перевірку на спецільний шаблон
-            if self.is_box_special_template:
-                self.modify_IME_special_box_pdf(self.template_path, doc_output, nominal, seria)
-            else:
-                self.modify_IME_box_pdf(self.template_path, doc_output, date_code, nominal, seria)
+        # Додаємо перевірку на спецільний шаблон
+        if self.is_box_special_template:
+            kind, fields = KIND_SPECIAL_BOX, self.IME_special_box_fields(nominal, seria)
+        else:
+            kind, fields = KIND_BOX, self.IME_box_fields(date_code, nominal, seria)
+
+        # Усі коробки в партії однакові: будуємо етикетку один раз і додаємо count копій
+        template_path = self.template_path
+        save_profile = self.save_profile_combo.currentData()
+        output_format, raster_mode, dpi = self.output_settings()
+        split_size = self.split_size()
+        if split_size and not output_format:
+            from sticker_batch import box_split_files
+            files = box_split_files(output_pdf, seria, nominal, date_code, count, split_size)
+            self.start_split_generation(kind, template_path, fields, files, os.cpu_count() or 1, save_profile)
+            return
+        if output_format:
+            from sticker_batch import write_printer_output
+            self.start_generation(lambda progress: write_printer_output(
+                kind, template_path, fields, None, count, output_pdf, output_format, dpi, raster_mode,
+                progress=progress))
+            return
+        self.start_generation(lambda progress: write_box_run(
+            get_template_plan(template_path, kind), fields, count, output_pdf, progress, save_profile))
+
+    def generate_batch_pdfs(self):
+        from sticker_batch import load_manifest, run_manifest
 
-        # Зберегти фінальний PDF файл з усіма сторінками
-        doc_output.save(output_pdf)
-        doc_output.close()
+        manifest_path, _ = QFileDialog.getOpenFileName(self, "Виберіть маніфест замовлень", "",
+                                                       "Маніфест (*.csv *.json)")
+        if not manifest_path:
+            return
+        try:
+            orders = load_manifest(manifest_path)
+        except Exception as e:
+            QMessageBox.critical(self, "Помилка", f"Помилка читання маніфесту: {e}")
+            return
+
+        folder = QFileDialog.getExistingDirectory(self, "Виберіть папку для збереження")
+        if not folder:
+            return
+
+        # Усі замовлення виконуються в одному фоновому завданні; шаблони і шрифти лишаються в кеші між ними
+        standard_templates, box_templates = self.standard_templates, self.box_templates
+        chunk_size = self.chunk_size
+        save_profile = self.save_profile_combo.currentData()
+        output_format, raster_mode, dpi = self.output_settings()
+        split_size = self.split_size()
+
+        def job(progress, log):
+            results = run_manifest(orders, standard_templates, box_templates, folder, progress,
+                                   chunk_size=chunk_size, save_profile=save_profile, output_format=output_format,
+                                   dpi=dpi, raster_mode=raster_mode, split_size=split_size, log=log)
+            errors = [f"{order['number']}. {order['template']}: {error}" for order, output_pdf, error in results
+                      if error]
+            if errors:
+                raise RuntimeError(f"Не виконано {len(errors)} з {len(results)} замовлень:\n" + "\n".join(errors))
+            return f"{folder} ({len(results)} замовлень)"
+
+        self.start_generation(job, with_log=True)
+
+    def output_settings(self):
+        # (формат, режим растра, DPI); формат None - PDF
+        output_format, raster_mode = self.output_format_combo.currentData()
+        return output_format, raster_mode, int(self.raster_dpi_input.text() or DEFAULT_RASTER_DPI)
+
+    def split_size(self):
+        # Стікерів у файлі для режиму розбиття; None - вся партія в одному файлі
+        return int(self.split_size_input.text() or 0) or None
+
+    def start_split_generation(self, kind, template_path, fields, files, workers, save_profile):
+        # Один статус на всю партію: папка і кількість файлів або одна помилка
+        from sticker_engine import write_split_run
+        folder = os.path.dirname(files[0][1])
+
+        def job(progress):
+            write_split_run(kind, template_path, fields, files, workers, progress, save_profile)
+            return f"{folder} (файлів: {len(files)})"
+
+        self.start_generation(job)
+
+    def start_generation(self, job, with_log=False, status="Генерація...", on_finished=None, on_failed=None):
+        # Запускає job у фоновому потоці; кнопки генерації й прев'ю недоступні до завершення.
+        # on_finished/on_failed - замість звичайних повідомлень про збережений файл чи помилку генерації
+        self.set_generation_running(True)
+        self.generation_progress_bar.setValue(0)
+        self.generation_status_label.setText(status)
+        self.generation_message = ""
+
+        self.generation_thread = QThread()
+        self.generation_worker = GenerationWorker(job, with_log)
+        self.generation_worker.moveToThread(self.generation_thread)
+        self.generation_thread.started.connect(self.generation_worker.run)
+        self.generation_worker.progress.connect(self.on_generation_progress)
+        self.generation_worker.message.connect(self.on_generation_message)
+        self.generation_worker.finished.connect(on_finished or self.on_generation_finished)
+        self.generation_worker.cancelled.connect(self.on_generation_cancelled)
+        self.generation_worker.failed.connect(on_failed or self.on_generation_failed)
+        for signal in (self.generation_worker.finished, self.generation_worker.cancelled,
+                       self.generation_worker.failed):
+            signal.connect(self.generation_thread.quit)
+        self.generation_thread.finished.connect(self.on_generation_thread_finished)
+        self.generation_thread.start()
+
+    def cancel_generation(self):
+        if self.generation_worker is not None:
+            self.generation_worker.cancel()
+            self.generation_status_label.setText("Скасування...")
+
+    def set_generation_running(self, running):
+        for widget in (self.generate_IME_standard_button, self.preview_IME_standard_button,
+                       self.generate_1_standard_sticker_button, self.append_reprint_checkbox,
+                       self.generate_IME_box_button, self.preview_IME_box_button, self.IME_standard_template_combo,
+                       self.IME_box_template_combo, self.batch_button, self.save_profile_combo,
+                       self.output_format_combo, self.raster_dpi_input, self.split_size_input):
+            widget.setEnabled(not running)
+        self.cancel_generation_button.setEnabled(running)
+
+    def on_generation_progress(self, done, total, rate, eta):
+        self.generation_progress_bar.setMaximum(total)
+        self.generation_progress_bar.setValue(done)
+        status = f"{done} з {total} стор. | {rate:.0f} стор./с | залишилось {eta:.0f} с"
+        self.generation_status_label.setText(f"{status}\n{self.generation_message}" if self.generation_message
+                                             else status)
+
+    def on_generation_message(self, message):
+        # Результат останнього замовлення пакета - під рядком прогресу; у журналі - усі
+        logger.info(message)
+        self.generation_message = message
+        self.generation_status_label.setText(message)
+
+    def on_generation_finished(self, output_pdf):
+        self.generation_status_label.setText(f"Збережено: {output_pdf}")
+
+    def on_generation_cancelled(self):
+        self.generation_progress_bar.setValue(0)
+        self.generation_status_label.setText("Генерацію скасовано")
+
+    def on_generation_failed(self, message):
+        self.generation_status_label.setText("Помилка генерації")
+        QMessageBox.critical(self, "Помилка", f"Помилка генерації PDF: {message}")
+
+    def on_generation_thread_finished(self):
+        self.generation_thread.deleteLater()
+        self.generation_worker.deleteLater()
+        self.generation_thread = None
+        self.generation_worker = None
+        self.set_generation_running(False)
+        if self.template_reload_pending:
+            self.template_reload_pending = False
+            self.template_reload_timer.start()
+        if self.template_index_pending:
+            self.template_index_pending = False
+            QTimer.singleShot(0, self.refresh_template_index)
+        if self.preview_resize_pending:
+            self.preview_resize_pending = False
+            self.preview_resize_timer.start()
+
+    def IME_standard_fields(self, serial_number, date_code, nominal, va, short_prefix, va_cl_02=None,
+                            va_cl_05s=None):
+        return standard_fields(date_code, nominal, va, short_prefix, self.art_seria_IME_standard_input.text(),
+                               self.add_3_checkbox.isChecked(), va_cl_02, va_cl_05s, serial_number)
 
     def modify_IME_standart_pdf(self, input_pdf, doc_output, serial_number, date_code, nominal, va, short_prefix,
                                 va_cl_02=None, va_cl_05s=None):
-        doc = fitz.open(input_pdf)
-        date_pattern = r"\d{2}W\d{2}"  # Шаблон для року і тижня
-        serial_pattern = r"^\s*\d{10}\s*$"  # Шаблон для серійного номера
-        ipr_pattern = r"Ipr\d+A"  # Шаблон для пошуку "Ipr"
-        d_ipr_pattern = r"Ipr $"  # Шаблон для пошуку "Ipr" перед числом
-        blank_ipr_pattern = r"Ipr \d+A"  # Шаблон для пошуку "Ipr "
-        article_pattern = r"^(TA|TT|TAS|TASS|TASO)\d+[C|B|D]\d+SE$"  # Шаблон для артикулу
-        seria_pattern = r"^(TA|TT|TAS|TASS|TASO)\d+B?$"  # Шаблон для серії
-
-        special_article_pattern = r"TASL50C6003S\+1,2/6KV\s{6}TAS65"
-        is_special_template = input_pdf.endswith("_special_1.pdf")
-
-        combined_pattern = r"^(TA|TT|TAS|TASS|TASO)\d+[C|B|D]\d+SE\s+(TA|TT|TAS|TASS|TASO)\d+B?"
-
-        for page in doc:
-            new_page = doc_output.new_page(width=page.rect.width, height=page.rect.height)
-            new_page.show_pdf_page(new_page.rect, doc, page.number)
-
-            text_blocks = page.get_text("dict")["blocks"]
-
-            for block in text_blocks:
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):
-                        span_text = span["text"]  # Поточний текст
-                        bbox = span["bbox"]  # Позиція тексту
-                        font_size = span["size"]  # Розмір шрифту
-                        font_name = span["font"]  # Назва шрифту
-
-                        font_path = self.font_mapping.get(font_name)
-
-                        print(span_text)
-
-                        x0, y0, a, b = bbox
-                        y0 += 0.1
-                        bbox = x0, y0, a, b
-
-                        # Заміна серійного номера
-                        if re.match(serial_pattern, span_text):
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            if serial_number is not None:
-                                new_page.insert_text((x0, y0 + font_size), serial_number, fontsize=font_size,
-                                                     color=(0, 0, 0),
-                                                     fontfile=font_path, fontname=font_name)
-
-                        # Заміна дати
-                        if re.match(date_pattern, span_text):
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0, y0 + font_size), date_code, fontsize=font_size, color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        # Заміна номіналу в тексті після "Ipr" та перед "A"
-                        if re.match(ipr_pattern, span_text):
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0, y0 + font_size), f"Ipr {nominal}A", fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        # Заміна номіналу в тексті після "Ipr" та перед "A"
-                        if re.match(d_ipr_pattern, span_text):
-                            bbox = x0, y0, a + 15, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0, y0 + font_size), f"Ipr {nominal}A", fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        if re.match(blank_ipr_pattern, span_text):
-                            bbox = x0, y0, a + 15, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0, y0 + font_size), f"Ipr {nominal}A", fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        # Заміна артикулу на кожній сторінці
-                        if re.fullmatch(article_pattern, span_text):
-                            local_nominal = nominal
-                            letter = "B"
-                            try:
-                                nominal_int = int(nominal)  # Перетворюємо nominal на ціле число
-                                if 100 <= nominal_int <= 999:  # Перевіряємо, чи nominal 3-значне
-                                    letter = "C"
-                                elif 1000 <= nominal_int <= 9999:  # Перевіряємо, чи nominal 4-значне
-                                    letter = "D"
-                                    local_nominal = nominal_int + 3  # Обчислюємо local_nominal
-                                    x0 -= 2
-                                else:
-                                    # Обробка ситуації, коли nominal не 3-значне і не 4-значне
-                                    print("nominal має бути 3- або 4-значним числом.")
-                            except ValueError:
-                                # Обробка помилки, якщо nominal не можна перетворити на ціле число
-                                print("Помилка: nominal має бути цілим числом.")
-
-                            new_text = f"{self.art_seria_IME_standard_input.text()}{letter}{local_nominal}SE"
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            if len(span_text) < len(new_text):
-                                x0 = x0 - ((len(new_text) - len(span_text)) * 3)
-                            elif len(span_text) > len(new_text):
-                                x0 = x0 + ((len(span_text) - len(new_text)) * 3)
-                            new_page.insert_text((x0, y0 + font_size), new_text,
-                                                 fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                 fontname=font_name)
-
-                        if re.match(seria_pattern, span_text):
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            if len(span_text) < len(short_prefix):
-                                x0 = x0 - ((len(short_prefix) - len(span_text)) * 3)
-                            elif len(span_text) > len(short_prefix):
-                                x0 = x0 + ((len(span_text) - len(short_prefix)) * 3)
-                            new_page.insert_text((x0, y0 + font_size), short_prefix,
-                                                 fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                 fontname=font_name)
-
-                        combined_match = re.search(combined_pattern, span_text)
-                        if combined_match:
-                            local_nominal = nominal
-                            letter = "B"
-                            try:
-                                nominal_int = int(nominal)
-                                if 100 <= nominal_int <= 999:
-                                    letter = "C"
-                                elif 1000 <= nominal_int <= 9999:
-                                    letter = "D"
-                                    local_nominal = nominal_int + 3
-                                else:
-                                    print("nominal має бути 3- або 4-значним числом.")
-                            except ValueError:
-                                print("Помилка: nominal має бути цілим числом.")
-
-                            new_text = f"{self.art_seria_IME_standard_input.text()}{letter}{local_nominal}SE     {short_prefix}"
-
-                            new_span_text = span_text.replace(span_text[combined_match.start():combined_match.end()],
-                                                              new_text)
-
-                            x0, y0, a, b = bbox
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0, y0 + font_size), new_span_text,
-                                                 fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                 fontname=font_name)
-
-                        if is_special_template:
-                            if re.fullmatch(special_article_pattern, span_text):
-                                local_nominal = nominal
-                                letter = "B"
-                                try:
-                                    nominal_int = int(nominal)
-                                    if 100 <= nominal_int <= 999:
-                                        letter = "C"
-                                    elif 1000 <= nominal_int <= 9999:
-                                        letter = "D"
-                                        local_nominal = nominal_int + 3
-                                    else:
-                                        print("nominal має бути 3- або 4-значним числом.")
-                                except ValueError:
-                                    print("Помилка: nominal має бути цілим числом.")
-
-                                three = "3" if self.add_3_checkbox.isChecked() else ""
-
-                                new_text = f"{self.art_seria_IME_standard_input.text()}{letter}{local_nominal}{three}S+1,2/6KV      {short_prefix}"
-                                x0, y0, a, b = bbox
-                                new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                new_page.apply_redactions()
-                                new_page.insert_text((x0, y0 + font_size), new_text,
-                                                     fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                     fontname=font_name)
-
-                            if re.match(r"^1$", span_text):
-                                bbox = x0, y0 + 1, a, b
-                                new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                new_page.apply_redactions()
-                                new_page.insert_text((x0, y0 + font_size - 0.1), va,
-                                                     fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                     fontname=font_name)
-
-                            if re.match(r"^3$", span_text):
-                                bbox = x0, y0 + 1, a, b
-                                new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                new_page.apply_redactions()
-                                new_page.insert_text((x0, y0 + font_size - 0.1), va_cl_02,
-                                                     fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                     fontname=font_name)
-
-                            if re.match(r"^5$", span_text):
-                                bbox = x0, y0 + 1, a, b
-                                new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                new_page.apply_redactions()
-                                new_page.insert_text((x0, y0 + font_size - 0.1), va_cl_05s,
-                                                     fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                     fontname=font_name)
-
-                        else:
-                            if re.match(r"^(15|10)$", span_text):
-                                bbox = x0, y0 + 1, a, b
-                                new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                new_page.apply_redactions()
-                                new_page.insert_text((x0, y0 + font_size - 0.1), va,
-                                                     fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                     fontname=font_name)
-
-                            if re.match(r"^(5|3)$", span_text):
-                                bbox = x0, y0 + 1, a, b
-                                new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                new_page.apply_redactions()
-                                va_num = int(va)
-                                minus = 0 if va_num < 9 else 2
-                                new_page.insert_text((x0 - minus, y0 + font_size - 0.1), va,
-                                                     fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                     fontname=font_name)
-
-        doc.close()
+        from sticker_engine import get_template_plan, render_plan
+        plan = get_template_plan(input_pdf, KIND_STANDARD)
+        fields = self.IME_standard_fields(serial_number, date_code, nominal, va, short_prefix, va_cl_02, va_cl_05s)
+        render_plan(plan, doc_output, fields)
+
+    def IME_box_fields(self, date_code, nominal, seria):
+        return box_fields(date_code, nominal, seria, self.art_seria_IME_box_input.text())
+
+    def IME_special_box_fields(self, nominal, seria):
+        return special_box_fields(nominal, seria, self.year_IME_box_input.text(), self.week_IME_box_input.text(),
+                                  self.add_3_checkbox_box.isChecked())
 
     def modify_IME_box_pdf(self, input_pdf, doc_output, date_code, nominal, seria):
-        doc = fitz.open(input_pdf)
-        date_pattern = r"\d{2}W\d{2}$"  # Шаблон для року і тижня
-        article_pattern = r"(TA|TT|TAS|TASS|TASO)\d+[C|B|D]\d+SE"  # Шаблон для артикулу
-        start_pattern = r"\s*(TA|TT|TAS|TASS|TASO)\d+B?$"
-        date_article_combined_pattern = r"(\d{2}W\d{2})\s+(TAS\d+[A-Z]?[0-9]*)"
-
-        for page in doc:
-            new_page = doc_output.new_page(width=page.rect.width, height=page.rect.height)
-            new_page.show_pdf_page(new_page.rect, doc, page.number)
-
-            text_blocks = page.get_text("dict")["blocks"]
-
-            for block in text_blocks:
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):
-                        span_text = span["text"]  # Поточний текст
-                        bbox = span["bbox"]  # Позиція тексту
-                        font_size = span["size"]  # Розмір шрифту
-                        font_name = span["font"]  # Назва шрифту
-
-                        font_path = self.font_mapping.get(font_name)
-
-                        print(span_text)
-
-                        # Заміна дати
-                        if re.match(date_pattern, span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0 - 1, y0 + font_size), date_code, fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        nominal_match = re.search(r"(\d{3,4})/5A", span_text)
-                        if nominal_match:
-                            extracted_nominal = nominal_match.group(1)
-                            try:
-                                extracted_nominal_int = int(extracted_nominal)
-                                if 100 <= extracted_nominal_int <= 9999:
-                                    # Замінюємо текст у span_text
-                                    new_span_text = span_text.replace(extracted_nominal, nominal)
-                                    x0, y0, a, b = bbox
-                                    bbox = x0, y0, a, b
-                                    new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                                    new_page.apply_redactions()
-
-                                    new_page.insert_text((x0, y0 + font_size), new_span_text,
-                                                         # Використовуємо new_span_text
-                                                         fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                         fontname=font_name)
-                            except ValueError:
-                                print(f"Помилка: '{extracted_nominal}' не є дійсним числом.")
-
-                        # Заміна артикулу на кожній сторінці
-                        if re.fullmatch(article_pattern, span_text):
-                            local_nominal = nominal
-                            letter = "B"
-                            try:
-                                nominal_int = int(nominal)  # Перетворюємо nominal на ціле число
-                                if 100 <= nominal_int <= 999:  # Перевіряємо, чи nominal 3-значне
-                                    letter = "C"
-                                elif 1000 <= nominal_int <= 9999:  # Перевіряємо, чи nominal 4-значне
-                                    letter = "D"
-                                    local_nominal = nominal_int + 3  # Обчислюємо local_nominal
-                                    x0 -= 2
-                                else:
-                                    # Обробка ситуації, коли nominal не 3-значне і не 4-значне
-                                    print("nominal має бути 3- або 4-значним числом.")
-                            except ValueError:
-                                # Обробка помилки, якщо nominal не можна перетворити на ціле число
-                                print("Помилка: nominal має бути цілим числом.")
-
-                            new_text = f"{self.art_seria_IME_box_input.text()}{letter}{local_nominal}SE"
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            x0, y0, a, b = bbox
-                            new_page.insert_text((x0, y0 + font_size), new_text,
-                                                 fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                 fontname=font_name)
-
-                        if re.match(start_pattern, span_text):
-                            x0, y0, a, b = bbox
-                            x0 += 1
-                            y0 += 1
-                            a -= 1
-                            b -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0 - 3, y0 + font_size), seria,
-                                                 fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                 fontname=font_name)
-
-                        date_article_match = re.search(date_article_combined_pattern, span_text)
-                        if date_article_match:
-                            combined_x0, combined_y0, combined_x1, combined_y1 = bbox
-
-                            extracted_date = date_article_match.group(1)
-                            extracted_seria = date_article_match.group(2)
-
-                            date_width = len(extracted_date) * 3  # Приблизна ширина дати
-                            seria_width = len(extracted_seria) * 3  # Приблизна ширина розділювача
-
-                            # Замінюємо дату
-                            new_page.add_redact_annot(
-                                (combined_x0, combined_y0, combined_x0 + date_width - 0.2, combined_y1 - 0.3),
-                                fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((combined_x0 - 4, combined_y0 + font_size), date_code,
-                                                 fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                            # Замінюємо серію
-                            seria_x0 = combined_x0 + date_width + 2
-                            new_page.add_redact_annot(
-                                (seria_x0, combined_y0, seria_x0 + seria_width, combined_y1 - 0.3),
-                                fill=[255, 255, 255])  # Приблизна ширина для серії
-                            new_page.apply_redactions()
-                            new_page.insert_text((seria_x0 + 1, combined_y0 + font_size), seria,
-                                                 fontsize=font_size, color=(0, 0, 0), fontfile=font_path,
-                                                 fontname=font_name)
-
-        doc.close()
+        from sticker_engine import get_template_plan, render_plan
+        plan = get_template_plan(input_pdf, KIND_BOX)
+        render_plan(plan, doc_output, self.IME_box_fields(date_code, nominal, seria))
 
     def modify_IME_special_box_pdf(self, input_pdf, doc_output, nominal, seria):
-        doc = fitz.open(input_pdf)
-        year = self.year_IME_box_input.text()
-        week = self.week_IME_box_input.text()
-
-        for page in doc:
-            new_page = doc_output.new_page(width=page.rect.width, height=page.rect.height)
-            new_page.show_pdf_page(new_page.rect, doc, page.number)
-
-            text_blocks = page.get_text("dict")["blocks"]
-
-            for block in text_blocks:
-                for line in block.get("lines", []):
-                    for span in line.get("spans", []):
-                        span_text = span["text"]  # Поточний текст
-                        bbox = span["bbox"]  # Позиція тексту
-                        font_size = span["size"]  # Розмір шрифту
-                        font_name = span["font"]  # Назва шрифту
-
-                        font_path = self.font_mapping.get(font_name)
-
-                        print(span_text)
-
-                        if re.match(r"TASL50C6003S", span_text):
-                            x0, y0, a, b = bbox
-                            local_nominal = nominal
-                            letter = "B"
-                            try:
-                                nominal_int = int(nominal)  # Перетворюємо nominal на ціле число
-                                if 100 <= nominal_int <= 999:  # Перевіряємо, чи nominal 3-значне
-                                    letter = "C"
-                                elif 1000 <= nominal_int <= 9999:  # Перевіряємо, чи nominal 4-значне
-                                    letter = "D"
-                                    local_nominal = nominal_int + 3  # Обчислюємо local_nominal
-                                    x0 -= 2
-                                else:
-                                    # Обробка ситуації, коли nominal не 3-значне і не 4-значне
-                                    print("nominal має бути 3- або 4-значним числом.")
-                            except ValueError:
-                                # Обробка помилки, якщо nominal не можна перетворити на ціле число
-                                print("Помилка: nominal має бути цілим числом.")
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            three = "3" if self.add_3_checkbox_box.isChecked() else ""
-                            new_page.insert_text((x0 + 1, y0 + font_size),
-                                                 f"{seria}{letter}{local_nominal}{three}S+0,8/1,2кВ",
-                                                 fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        if re.match(r"21$", span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-
-                        if re.match(r"W$", span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-
-                        if re.match(r"37$", span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            x_minus = 11
-                            if year == 11 and week == 11:
-                                x_minus = 6
-                            new_page.insert_text((x0 - x_minus, y0 + font_size), f"{year}W{week}",
-                                                 fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        if re.match(r"T$", span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-
-                        if re.match(r"AS$", span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-
-                        if re.match(r"65$", span_text):
-                            x0, y0, a, b = bbox
-                            a -= 1
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0 - 9, y0 + font_size), seria,
-                                                 fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        if re.match(r"32x65mm 6$", span_text):
-                            x0, y0, a, b = bbox
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0, y0 + font_size), "32x65mm ",
-                                                 fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
-
-                        if re.match(r"00/5AM.L$", span_text):
-                            x0, y0, a, b = bbox
-                            a += 20
-                            bbox = x0, y0, a, b
-                            new_page.add_redact_annot(bbox, fill=[255, 255, 255])
-                            new_page.apply_redactions()
-                            new_page.insert_text((x0 - 2, y0 + font_size), f"{nominal}/5AM.L LUNGO",
-                                                 fontsize=font_size,
-                                                 color=(0, 0, 0),
-                                                 fontfile=font_path, fontname=font_name)
+        from sticker_engine import get_template_plan, render_plan
+        plan = get_template_plan(input_pdf, KIND_SPECIAL_BOX)
+        render_plan(plan, doc_output, self.IME_special_box_fields(nominal, seria))
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self.preview_resize_timer.start()
+
+    def redraw_previews(self):
+        # Прев'ю малюються під новий розмір області; у межах кроку PREVIEW_SLOT_STEP беруться з кешу
+        if self.generation_thread is not None:
+            self.preview_resize_pending = True  # PyMuPDF зайнятий фоновим потоком
+            return
+        if self.template_path:
+            self.display_template_preview(self.template_path)
+            self.schedule_live_preview()
 
     def closeEvent(self, event):
-        if os.path.exists(self.temp_preview_path):
-            os.remove(self.temp_preview_path)
-            print(f"Тимчасовий файл видалено: {self.temp_preview_path}")
+        self.closing = True
+        if self.generation_thread is not None:
+            # Перериваємо незавершену генерацію; частковий файл не зберігається
+            self.generation_worker.cancel()
+            self.generation_thread.quit()
+            self.generation_thread.wait()
         super().closeEvent(event)
 
 
+def report_startup_time(window):
+    # Викликається з циклу подій, коли вікно вже намальоване; час інтерпретатора до першого рядка не враховано
+    shown = time.perf_counter()
+    print(f"Імпорти: {(IMPORTS_DONE_TIME - STARTUP_TIME) * 1000:.0f} мс, "
+          f"вікно показано через {(shown - STARTUP_TIME) * 1000:.0f} мс, "
+          f"PyMuPDF завантажено: {'так' if 'fitz' in sys.modules else 'ні'}")
+    window.close()  # Через closeEvent: дочекатися фонового оновлення індексу шаблонів
+
+
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Для процесів паралельної генерації у зібраному .exe
+    configure_logging()  # STICKERMASTER_LOG=DEBUG - показати розбір шаблонів
     app = QApplication(sys.argv)
     window = StickerGeneratorApp()
     window.show()
+    if "--startup-time" in sys.argv:
+        # Перевірка швидкості запуску після оновлень: python StickerMaster.py --startup-time
+        QTimer.singleShot(0, lambda: report_startup_time(window))
+    # Після показу вікна: індекс скомпільованих шаблонів, щоб перша генерація не аналізувала шаблон
+    QTimer.singleShot(0, window.refresh_template_index)
     sys.exit(app.exec())
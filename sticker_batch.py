@@ -0,0 +1,266 @@
+import csv
+import json
+import os
+
+from sticker_catalog import DEFAULT_CHUNK_SIZE, DEFAULT_SAVE_PROFILE, DEFAULT_RASTER_DPI, DEFAULT_RASTER_MODE, \
+    ZPL_EXTENSION, \
+    KIND_STANDARD, KIND_SPECIAL_BOX, box_kind, standard_output_name, box_output_name, standard_fields, box_fields, \
+    special_box_fields, parse_serial_selection, reprint_output_name, split_numbers, box_split_name
+from sticker_engine import get_template_plan, write_standard_run, write_standard_run_parallel, write_box_run, \
+    append_standard_run, write_split_run, GenerationCancelled
+
+# Пакет замовлень в одному завданні. Маніфест - CSV з заголовком або JSON (список чи {"orders": [...]}),
+# колонки/ключі такі ж, як параметри sticker_cli.py:
+#   type,template,prefix,series,art_series,nominal,va,va_cl_02s,va_cl_02,va_cl_05s,year,week,count,add_3,start
+#   standard,TAS 84 1000SE,241800,TAS84,,1000,10,,,,24,18,500,,
+#   box,TAS 65_box_special_1,,TAS65,,600,,,,,24,18,20,1,
+# type можна не вказувати, якщо назва шаблону є лише серед стандартних або лише серед коробок.
+# Передрук стандартних стікерів: serials - номери й діапазони, напр. "0150-0300,0412,0977" (count тоді
+# не потрібен); append_to - існуючий PDF замовлення, в кінець якого дописуються ці сторінки.
+# Скомпільовані шаблони і шрифти кешуються в процесі, тож замовлення з тим самим шаблоном їх не перечитують.
+
+ORDER_TYPES = ("standard", "box")
+REQUIRED_FIELDS = ("template", "series", "nominal", "year", "week", "count")
+TEXT_FIELDS = ("type", "template", "prefix", "series", "art_series", "nominal", "va", "va_cl_02s", "va_cl_02",
+               "va_cl_05s", "year", "week", "serials", "append_to")
+
+
+def _flag(value):
+    if isinstance(value, bool):
+        return value
+    return str(value or "").strip().lower() in ("1", "true", "yes", "так", "+", "x")
+
+
+def normalize_order(raw, number):
+    # Приводить рядок маніфесту до словника з усіма полями; number - номер замовлення для повідомлень
+    order = {name: str(raw.get(name) or "").strip() for name in TEXT_FIELDS}
+    required = [name for name in REQUIRED_FIELDS if name != "count" or not order["serials"]]
+    missing = [name for name in required if not str(raw.get(name) or "").strip()]
+    if missing:
+        raise ValueError(f"Замовлення {number}: не заповнено {', '.join(missing)}")
+    if order["type"] and order["type"] not in ORDER_TYPES:
+        raise ValueError(f"Замовлення {number}: невідомий тип '{order['type']}' (standard або box)")
+    order["numbers"] = None
+    if order["serials"]:
+        try:
+            order["numbers"] = parse_serial_selection(order["serials"])
+        except ValueError as e:
+            raise ValueError(f"Замовлення {number}: {e}")
+    try:
+        order["count"] = len(order["numbers"]) if order["numbers"] else int(raw["count"])
+        order["start"] = int(raw.get("start") or 1)
+    except ValueError:
+        raise ValueError(f"Замовлення {number}: кількість і перший номер мають бути числами")
+    order["add_3"] = _flag(raw.get("add_3"))
+    order["number"] = number
+    return order
+
+
+def load_manifest(path):
+    # Помилки читання і формату маніфесту - ValueError з назвою файлу, як і помилки замовлень
+    name = os.path.basename(path)
+    try:
+        if path.lower().endswith(".json"):
+            with open(path, encoding="utf-8") as f:
+                rows = json.load(f)
+            if isinstance(rows, dict):
+                rows = rows.get("orders")
+        else:
+            # utf-8-sig: Excel зберігає CSV з BOM
+            with open(path, encoding="utf-8-sig", newline="") as f:
+                sample = f.read(4096)
+                f.seek(0)
+                try:
+                    dialect = csv.Sniffer().sniff(sample, delimiters=",;\t")
+                except csv.Error:
+                    dialect = csv.excel  # Одна колонка - роздільник не визначити, читаємо як звичайний CSV
+                rows = list(csv.DictReader(f, dialect=dialect))
+    except OSError as e:
+        raise ValueError(f"Маніфест '{name}' не прочитано: {e.strerror or e}")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Маніфест '{name}': некоректний JSON (рядок {e.lineno}: {e.msg})")
+    except csv.Error as e:
+        raise ValueError(f"Маніфест '{name}': некоректний CSV ({e})")
+    if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+        raise ValueError(f"Маніфест '{name}': очікується список замовлень або {{\"orders\": [...]}}")
+    return [normalize_order(row, number) for number, row in enumerate(rows, 1)]
+
+
+def resolve_template(template, templates):
+    # Шаблон можна вказати шляхом до PDF або назвою з комбобоксу програми
+    if os.path.isfile(template):
+        return os.path.splitext(os.path.basename(template))[0], template
+    if template in templates:
+        return template, templates[template]
+    raise ValueError(f"Шаблон '{template}' не знайдено. Доступні: {', '.join(sorted(templates))}")
+
+
+def order_type(order, standard_templates, box_templates):
+    if order["type"]:
+        return order["type"]
+    template = order["template"]
+    if os.path.isfile(template):
+        return "box" if os.path.basename(template).startswith("box_") else "standard"
+    if template in standard_templates and template not in box_templates:
+        return "standard"
+    if template in box_templates and template not in standard_templates:
+        return "box"
+    raise ValueError(f"Замовлення {order.get('number', '')}: вкажіть type для шаблону '{template}'")
+
+
+def prepare_order(order, standard_templates, box_templates, output_dir):
+    # Повертає (тип шаблону, шлях до шаблону, поля, вихідний файл) без генерації
+    date_code = f"{order['year']}W{order['week']}"
+    if order_type(order, standard_templates, box_templates) == "standard":
+        template_name, template_path = resolve_template(order["template"], standard_templates)
+        if template_path.endswith("_special_1.pdf"):
+            fields = standard_fields(date_code, order["nominal"], order["va_cl_02s"], order["series"],
+                                     order["art_series"], order["add_3"], order["va_cl_02"], order["va_cl_05s"])
+        else:
+            if not order["va"].isdigit():
+                raise ValueError(f"Для шаблону '{template_name}' va має бути числом, напр. 10")
+            fields = standard_fields(date_code, order["nominal"], order["va"], order["series"], order["art_series"],
+                                     order["add_3"])
+        if order["append_to"]:
+            return KIND_STANDARD, template_path, fields, order["append_to"]
+        if order["numbers"]:
+            output_name = reprint_output_name(order["series"], order["nominal"], date_code, order["numbers"])
+        else:
+            output_name = standard_output_name(order["series"], order["nominal"], date_code, order["count"])
+        return KIND_STANDARD, template_path, fields, os.path.join(output_dir, output_name)
+
+    if order["serials"] or order["append_to"]:
+        raise ValueError(f"Замовлення {order.get('number', '')}: serials і append_to - лише для стандартних стікерів")
+    template_name, template_path = resolve_template(order["template"], box_templates)
+    kind = box_kind(template_name)
+    if kind == KIND_SPECIAL_BOX:
+        fields = special_box_fields(order["nominal"], order["series"], order["year"], order["week"], order["add_3"])
+    else:
+        fields = box_fields(date_code, order["nominal"], order["series"], order["art_series"])
+    output_name = box_output_name(order["series"], order["nominal"], date_code, order["count"])
+    return kind, template_path, fields, os.path.join(output_dir, output_name)
+
+
+def standard_split_files(output_pdf, prefix, short_prefix, nominal, date_code, numbers, split_size):
+    # Режим розбиття: файли по split_size стікерів у папці з назвою PDF замовлення,
+    # напр. "TAS84 1000A 24W18-5000шт/TAS84 1000A 24W18 #0001-0250-250шт.pdf".
+    # Повертає список (серійні номери, файл) для write_split_run
+    folder = os.path.splitext(output_pdf)[0]
+    return [([f"{prefix}{i:04}" for i in chunk], os.path.join(folder, reprint_output_name(short_prefix, nominal,
+                                                                                          date_code, chunk)))
+            for chunk in split_numbers(list(numbers), split_size)]
+
+
+def box_split_files(output_pdf, seria, nominal, date_code, count, split_size):
+    # Те саме для коробок: "... -КОРОБКА #0001-0250-250шт.pdf"; повертає (кількість коробок, файл)
+    folder = os.path.splitext(output_pdf)[0]
+    return [(len(chunk), os.path.join(folder, box_split_name(seria, nominal, date_code, chunk)))
+            for chunk in split_numbers(list(range(1, count + 1)), split_size)]
+
+
+def run_order(order, standard_templates, box_templates, output_dir, progress=None, workers=1,
+              chunk_size=DEFAULT_CHUNK_SIZE, save_profile=DEFAULT_SAVE_PROFILE, output_format=None,
+              dpi=DEFAULT_RASTER_DPI, raster_mode=DEFAULT_RASTER_MODE, split_size=None):
+    # output_format: None - PDF, інакше див. write_printer_output.
+    # split_size: партія розбивається на PDF по split_size стікерів, повертається папка з ними
+    kind, template_path, fields, output_pdf = prepare_order(order, standard_templates, box_templates, output_dir)
+    serial_numbers = None
+    numbers = order["numbers"] or range(order["start"], order["start"] + order["count"])
+    if kind == KIND_STANDARD:
+        serial_numbers = [f"{order['prefix']}{i:04}" for i in numbers]
+    if split_size:
+        if output_format or order["append_to"]:
+            raise ValueError("Розбиття на файли - лише для нових PDF")
+        date_code = f"{order['year']}W{order['week']}"
+        if kind == KIND_STANDARD:
+            files = standard_split_files(output_pdf, order["prefix"], order["series"], order["nominal"], date_code,
+                                         numbers, split_size)
+        else:
+            files = box_split_files(output_pdf, order["series"], order["nominal"], date_code, order["count"],
+                                    split_size)
+        write_split_run(kind, template_path, fields, files, workers, progress, save_profile)
+        return os.path.splitext(output_pdf)[0]
+    if order["append_to"]:
+        if output_format:
+            raise ValueError("Дописати в існуючий файл можна лише PDF")
+        if not os.path.isfile(output_pdf):
+            raise ValueError(f"Файл замовлення '{output_pdf}' не знайдено")
+        return append_standard_run(get_template_plan(template_path, kind), fields, serial_numbers, output_pdf,
+                                   progress, chunk_size if order["count"] > chunk_size else None, save_profile)
+    if output_format:
+        return write_printer_output(kind, template_path, fields, serial_numbers, order["count"], output_pdf,
+                                    output_format, dpi, raster_mode, workers, progress)
+    if kind != KIND_STANDARD:
+        return write_box_run(get_template_plan(template_path, kind), fields, order["count"], output_pdf, progress,
+                             save_profile)
+
+    if workers > 1:
+        return write_standard_run_parallel(template_path, fields, serial_numbers, output_pdf, workers, progress,
+                                           save_profile=save_profile)
+    # Довгі партії пишуться у файл частинами, щоб пам'ять не росла з кількістю стікерів
+    return write_standard_run(get_template_plan(template_path, kind), fields, serial_numbers, output_pdf, progress,
+                              chunk_size if order["count"] > chunk_size else None, save_profile)
+
+
+def write_printer_output(kind, template_path, fields, serial_numbers, count, output_pdf, output_format,
+                         dpi=DEFAULT_RASTER_DPI, raster_mode=DEFAULT_RASTER_MODE, workers=1, progress=None):
+    # Вивід для етикеткових принтерів замість PDF; назва - як у PDF:
+    #   "zpl" - файл .zpl з командами принтера (sticker_zpl.py);
+    #   "png"/"tiff" - папка з растром на кожен стікер (sticker_raster.py).
+    # serial_numbers - для стандартних стікерів, count - для коробок
+    output_base = os.path.splitext(output_pdf)[0]
+    plan = get_template_plan(template_path, kind)
+    if output_format == "zpl":
+        from sticker_zpl import write_standard_zpl, write_box_zpl
+        if kind != KIND_STANDARD:
+            return write_box_zpl(plan, fields, count, output_base + ZPL_EXTENSION, dpi, progress)
+        return write_standard_zpl(plan, fields, serial_numbers, output_base + ZPL_EXTENSION, dpi, progress)
+
+    from sticker_raster import write_standard_raster, write_box_raster
+    if kind != KIND_STANDARD:
+        return write_box_raster(plan, fields, count, output_base, dpi, output_format, raster_mode, progress)
+    return write_standard_raster(template_path, fields, serial_numbers, output_base, dpi, output_format, raster_mode,
+                                 workers, progress)
+
+
+def run_manifest(orders, standard_templates, box_templates, output_dir, progress=None, workers=1,
+                 chunk_size=DEFAULT_CHUNK_SIZE, save_profile=DEFAULT_SAVE_PROFILE, output_format=None,
+                 dpi=DEFAULT_RASTER_DPI, raster_mode=DEFAULT_RASTER_MODE, split_size=None, log=None):
+    # Виконує всі замовлення одне за одним; помилка в одному замовленні не зупиняє решту,
+    # а скасування (GenerationCancelled з progress) зупиняє весь пакет. log(повідомлення) - результат
+    # кожного замовлення (CLI друкує його, програма показує в рядку стану).
+    # Повертає список (замовлення, вихідний файл або None, текст помилки або None)
+    totals = []
+    for order in orders:
+        try:
+            kind, template_path, fields, output_pdf = prepare_order(order, standard_templates, box_templates,
+                                                                    output_dir)
+            totals.append(order["count"] * len(get_template_plan(template_path, kind).pages))
+        except Exception:
+            totals.append(0)  # Помилку буде показано під час виконання замовлення
+    grand_total = sum(totals)
+
+    results = []
+    done_before = 0
+    for order, order_total in zip(orders, totals):
+        def order_progress(done, total, offset=done_before):
+            if progress is not None:
+                progress(offset + done, grand_total)
+
+        try:
+            output_pdf = run_order(order, standard_templates, box_templates, output_dir, order_progress, workers,
+                                   chunk_size, save_profile, output_format, dpi, raster_mode, split_size)
+        except GenerationCancelled:
+            raise
+        except Exception as e:
+            results.append((order, None, str(e)))
+            if log is not None:
+                log(f"Замовлення {order['number']} ({order['template']}): помилка: {e}")
+        else:
+            results.append((order, output_pdf, None))
+            if log is not None:
+                log(f"Замовлення {order['number']}: {output_pdf}")
+        done_before += order_total
+        if progress is not None:
+            progress(done_before, grand_total)
+    return results
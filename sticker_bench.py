@@ -0,0 +1,215 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from sticker_profile import memory_usage_mb
+from sticker_catalog import BASE_DIR, DEFAULT_CHUNK_SIZE, SAVE_PROFILES, DEFAULT_SAVE_PROFILE, KIND_STANDARD, \
+    KIND_SPECIAL_BOX, scan_templates, box_kind, standard_fields, box_fields, special_box_fields
+
+# Вимірювання швидкості генерації на всіх шаблонах з templates/, наприклад:
+#   python sticker_bench.py --output bench.json
+#   python sticker_bench.py --sizes 1 100 --compare bench.json
+#   python sticker_bench.py --sizes 1000 --save-profiles fast compact   # час запису проти розміру файлу
+# Кожен випадок виконується в окремому процесі, щоб пікова пам'ять не накопичувалась між випадками.
+# Стандартні партії понад DEFAULT_CHUNK_SIZE пишуться частинами без повного перезапису файлу (пам'ять
+# не росте з довжиною партії), тому профілі стискають їх слабше, ніж короткі партії. TAS 84 1000SE,
+# Б/стор. для 1000 і 5000 стікерів: balanced 727 -> 772, compact 229 -> 681; fast не змінюється.
+
+DEFAULT_SIZES = [1, 100, 1000, 10000]
+DEFAULT_THRESHOLD = 0.15  # Погіршення більше ніж на 15% вважається регресією
+BENCH_PREFIX = "241800"  # Перші 6 цифр серійного номера, як у справжніх замовленнях
+
+# Метрики для порівняння з базовими результатами: назва -> True, якщо більше - краще
+METRICS = {
+    "pages_per_s": True,
+    "bytes_per_page": False,
+    "peak_rss_mb": False,
+    "save_s": False,
+}
+
+# Абсолютні зміни, менші за ці, вважаються шумом вимірювання
+NOISE_FLOOR = {
+    "save_s": 0.05,
+    "peak_rss_mb": 5,
+}
+
+
+def bench_fields(kind, template_path):
+    # Типові значення полів; для бенчмарку важливий лише обсяг роботи, а не конкретні числа
+    if kind == KIND_STANDARD:
+        if template_path.endswith("_special_1.pdf"):
+            return standard_fields("24W18", "3000", "5", "TAS102", "", True, "10", "15")
+        return standard_fields("24W18", "600", "10", "TAS84", "50")
+    if kind == KIND_SPECIAL_BOX:
+        return special_box_fields("600", "TAS65", "24", "18", True)
+    return box_fields("24W18", "500", "TA327", "50")
+
+
+def list_cases(templates_dir, sizes, save_profiles, only=None):
+    standard_templates, box_templates = scan_templates(templates_dir)
+    cases = []
+    for template_name, template_path in sorted(standard_templates.items()):
+        cases.append((template_name, template_path, KIND_STANDARD))
+    for template_name, template_path in sorted(box_templates.items()):
+        cases.append((template_name, template_path, box_kind(template_name)))
+    return [(name, path, kind, count, save_profile) for name, path, kind in cases for count in sizes
+            for save_profile in save_profiles if not only or any(part in name for part in only)]
+
+
+def run_case(template_path, kind, count, save_profile):
+    # Виконується в окремому процесі; рахує час збереження, обгортаючи запис файлу в движку
+    import sticker_engine
+
+    save_time = [0.0]
+
+    def timed(function):
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                save_time[0] += time.perf_counter() - start
+        return wrapper
+
+    sticker_engine.save_output = timed(sticker_engine.save_output)
+    sticker_engine._append_part = timed(sticker_engine._append_part)
+
+    fields = bench_fields(kind, template_path)
+    with tempfile.TemporaryDirectory() as temp_dir:
+        output_pdf = os.path.join(temp_dir, "bench.pdf")
+        start = time.perf_counter()
+        plan = sticker_engine.get_template_plan(template_path, kind)
+        if kind == KIND_STANDARD:
+            # Як у програмі: довгі партії пишуться частинами
+            chunk_size = DEFAULT_CHUNK_SIZE if count > DEFAULT_CHUNK_SIZE else None
+            serial_numbers = [f"{BENCH_PREFIX}{i:04}" for i in range(1, count + 1)]
+            sticker_engine.write_standard_run(plan, fields, serial_numbers, output_pdf, chunk_size=chunk_size,
+                                              save_profile=save_profile)
+        else:
+            sticker_engine.write_box_run(plan, fields, count, output_pdf, save_profile=save_profile)
+        seconds = time.perf_counter() - start
+        pages = count * len(plan.pages)
+        size = os.path.getsize(output_pdf)
+
+    peak = memory_usage_mb()[1]
+    return {
+        "pages": pages,
+        "seconds": round(seconds, 4),
+        "pages_per_s": round(pages / seconds, 2),
+        "bytes_per_page": round(size / pages, 1),
+        "peak_rss_mb": round(peak, 1) if peak is not None else None,
+        "save_s": round(save_time[0], 4),
+    }
+
+
+def run_benchmarks(templates_dir, sizes, save_profiles=(DEFAULT_SAVE_PROFILE,), only=None, log=print):
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for template_name, template_path, kind, count, save_profile in list_cases(templates_dir, sizes, save_profiles,
+                                                                              only):
+        result = {"template": template_name, "kind": kind, "count": count, "save_profile": save_profile}
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            try:
+                result.update(pool.submit(run_case, template_path, kind, count, save_profile).result())
+            except Exception as e:
+                result["error"] = str(e)
+        results.append(result)
+        if "error" in result:
+            log(f"{template_name} x{count} [{save_profile}]: помилка: {result['error']}")
+        else:
+            log(f"{template_name} x{count} [{save_profile}]: {result['pages_per_s']} стор./с, "
+                f"{result['bytes_per_page']} Б/стор., "
+                f"пам'ять {result['peak_rss_mb']} МБ, збереження {result['save_s']} с")
+    return results
+
+
+def compare(results, baseline, threshold):
+    # Повертає список регресій: випадки, де метрика погіршилась більше ніж на threshold
+    def key(case):
+        return case["template"], case["count"], case.get("save_profile", DEFAULT_SAVE_PROFILE)
+
+    baseline_cases = {key(case): case for case in baseline["results"]}
+    regressions = []
+    for case in results:
+        old = baseline_cases.get(key(case))
+        if old is None or "error" in old:
+            continue
+        if "error" in case:
+            regressions.append({"template": case["template"], "count": case["count"],
+                                "save_profile": case["save_profile"], "metric": "error",
+                                "baseline": None, "current": case["error"]})
+            continue
+        for metric, higher_is_better in METRICS.items():
+            before, after = old.get(metric), case.get(metric)
+            if not before or after is None:
+                continue
+            if abs(after - before) < NOISE_FLOOR.get(metric, 0):
+                continue
+            change = (after - before) / before
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append({"template": case["template"], "count": case["count"],
+                                    "save_profile": case["save_profile"], "metric": metric,
+                                    "baseline": before, "current": after, "change": round(change, 3)})
+    return regressions
+
+
+def environment():
+    import fitz  # PyMuPDF
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "pymupdf": fitz.VersionBind,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Бенчмарк генерації стікерів на шаблонах з templates/")
+    parser.add_argument("--templates-dir", default=os.path.join(BASE_DIR, "templates"))
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Кількість стікерів у партії")
+    parser.add_argument("--save-profiles", nargs="+", choices=sorted(SAVE_PROFILES), default=list(SAVE_PROFILES),
+                        help="Профілі збереження для порівняння швидкості і розміру")
+    parser.add_argument("--only", nargs="+", help="Лише шаблони, назва яких містить один із рядків")
+    parser.add_argument("--output", help="Зберегти результати у JSON")
+    parser.add_argument("--compare", help="JSON з базовими результатами; регресії дають код виходу 1")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="Допустиме погіршення метрики (частка), за замовчуванням 0.15")
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    report = {
+        "environment": environment(),
+        "results": run_benchmarks(args.templates_dir, args.sizes, args.save_profiles, args.only),
+    }
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Результати збережено: {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report["results"], baseline, args.threshold)
+        for regression in regressions:
+            print(f"РЕГРЕСІЯ {regression['template']} x{regression['count']} [{regression['save_profile']}] "
+                  f"{regression['metric']}: "
+                  f"{regression['baseline']} -> {regression['current']}")
+        if regressions:
+            return 1
+        print("Регресій не знайдено")
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,264 @@
+import hashlib
+import json
+import logging
+import os
+import re
+from contextlib import contextmanager
+
+# Легка частина движка без PyMuPDF: список шаблонів, поля та назви файлів.
+# Імпортується при старті програми, поки fitz ще не завантажений.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LISTING_CACHE_NAME = ".templates.json"
+THUMBNAIL_DIR_NAME = ".thumbnails"  # Кеш прев'ю шаблонів (PNG) поруч із шаблонами
+HASH_INDEX_NAME = "index.json"
+PLAN_INDEX_NAME = ".plans.json"  # Скомпільовані шаблони (сторінки, слоти, шрифти, правила) за хешем вмісту PDF
+
+# Скільки стікерів тримати в пам'яті перед дописуванням у файл
+DEFAULT_CHUNK_SIZE = 1000
+
+# Профілі збереження PDF: швидкість проти розміру файлу.
+#   fast - без підмножини шрифтів і стиснення, для швидкого друку оператором;
+#   balanced - підмножина шрифтів + потоки об'єктів (дрібні об'єкти сторінок пакуються разом);
+#   compact - додатково злиття однакових об'єктів, прибирання сміття і стиснення, для архіву й друкарні.
+SAVE_PROFILES = {
+    "fast": {"subset_fonts": False, "options": {}},
+    "balanced": {"subset_fonts": True, "options": {"use_objstms": 1}},
+    "compact": {"subset_fonts": True,
+                "options": {"garbage": 4, "deflate": True, "deflate_fonts": True, "use_objstms": 1}},
+}
+DEFAULT_SAVE_PROFILE = "balanced"
+
+# Растровий експорт для етикеткових принтерів (sticker_raster.py): формат -> розширення файлу.
+#   mono - 1 біт на піксель (поріг), gray - 8-бітні відтінки сірого
+RASTER_FORMATS = {"png": ".png", "tiff": ".tif"}
+RASTER_MODES = ("mono", "gray")
+DEFAULT_RASTER_MODE = "mono"
+DEFAULT_RASTER_DPI = 300
+ZPL_EXTENSION = ".zpl"  # Команди для термопринтерів Zebra (sticker_zpl.py), DPI - як для растра
+
+# Рівень журналу (DEBUG показує, яке правило отримав кожен span шаблону)
+LOG_LEVEL_ENV = "STICKERMASTER_LOG"
+
+# Типи шаблонів
+KIND_STANDARD = "standard"
+KIND_BOX = "box"
+KIND_SPECIAL_BOX = "special_box"
+
+
+def configure_logging(level=None):
+    level = (level or os.environ.get(LOG_LEVEL_ENV) or "WARNING").upper()
+    logging.basicConfig(level=level, format="%(levelname)s %(name)s: %(message)s")
+
+
+def _classify_templates(templates_dir, filenames):
+    # Шаблони розрізняються за префіксом назви файлу: standard_* та box_*
+    standard_templates = {}
+    box_templates = {}
+    for filename in filenames:
+        if filename.endswith(".pdf"):
+            template_name = filename[:-4]  # Видаляємо розширення .pdf
+            file_path = os.path.join(templates_dir, filename)
+            if template_name.startswith("standard_"):
+                standard_templates[template_name[9:]] = file_path  # Видаляємо префікс "standard_"
+            elif template_name.startswith("box_"):
+                box_templates[template_name[4:]] = file_path  # Видаляємо префікс "box_"
+    return standard_templates, box_templates
+
+
+def scan_templates(templates_dir):
+    return _classify_templates(templates_dir, os.listdir(templates_dir))
+
+
+def load_template_listing(templates_dir):
+    # Список файлів кешується поруч із шаблонами і перечитується лише тоді, коли змінився
+    # вміст папки (mtime папки змінюється при додаванні, видаленні чи перейменуванні файлу)
+    cache_path = os.path.join(templates_dir, LISTING_CACHE_NAME)
+    dir_mtime = os.stat(templates_dir).st_mtime
+    try:
+        with open(cache_path, encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache["mtime"] == dir_mtime:
+            return _classify_templates(templates_dir, cache["files"])
+    except (OSError, ValueError, KeyError):
+        pass
+
+    filenames = [filename for filename in os.listdir(templates_dir) if filename != LISTING_CACHE_NAME]
+    try:
+        with open(cache_path, "w", encoding="utf-8") as f:
+            json.dump({"mtime": dir_mtime, "files": filenames}, f, ensure_ascii=False)
+        # Створення файлу кешу саме змінює mtime папки - запам'ятовуємо новий
+        new_mtime = os.stat(templates_dir).st_mtime
+        if new_mtime != dir_mtime:
+            with open(cache_path, "w", encoding="utf-8") as f:
+                json.dump({"mtime": new_mtime, "files": filenames}, f, ensure_ascii=False)
+    except OSError:
+        pass  # Папка лише для читання - працюємо без кешу
+    return _classify_templates(templates_dir, filenames)
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_hash_index(index_path):
+    try:
+        with open(index_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_hash_index(index_path, index):
+    # Тимчасовий файл з pid: індекс можуть зберігати кілька процесів одночасно
+    part_path = f"{index_path}.{os.getpid()}.part"
+    try:
+        os.makedirs(os.path.dirname(index_path), exist_ok=True)
+        with open(part_path, "w", encoding="utf-8") as f:
+            json.dump(index, f, ensure_ascii=False)
+        os.replace(part_path, index_path)
+    except OSError:
+        pass  # Папка лише для читання - хеші порахуються наступного разу
+
+
+@contextmanager
+def part_file(path):
+    # Запис результату через тимчасовий <path>.part: файл отримує свою назву лише після успішного запису,
+    # а при помилці чи перериванні частковий файл видаляється і старий результат лишається цілим
+    part_path = path + ".part"
+    try:
+        yield part_path
+        os.replace(part_path, path)
+    except BaseException:
+        if os.path.exists(part_path):
+            os.remove(part_path)
+        raise
+
+
+def cached_file_hash(path, index):
+    # Хеш вмісту перераховується лише тоді, коли змінились mtime або розмір файлу.
+    # Повертає (хеш, попередній хеш або None, якщо файл не змінювався)
+    stat = os.stat(path)
+    key = os.path.abspath(path)
+    entry = index.get(key)
+    if entry and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+        return entry["hash"], None
+    content_hash = file_hash(path)
+    index[key] = {"mtime": stat.st_mtime, "size": stat.st_size, "hash": content_hash}
+    return content_hash, entry["hash"] if entry and entry["hash"] != content_hash else None
+
+
+def load_plan_index(templates_dir):
+    # {"files": {шлях: mtime, розмір, хеш}, "plans": {"хеш:тип": скомпільований шаблон}}
+    index = load_hash_index(os.path.join(templates_dir, PLAN_INDEX_NAME))
+    index.setdefault("files", {})
+    index.setdefault("plans", {})
+    return index
+
+
+def box_kind(template_name):
+    return KIND_SPECIAL_BOX if template_name.endswith("_box_special_1") else KIND_BOX
+
+
+def standard_output_name(short_prefix, nominal, date_code, count):
+    return f"{short_prefix} {nominal}A {date_code}-{count}шт.pdf"
+
+
+def parse_serial_selection(text):
+    # Номери для передруку: "0150-0300, 0412, 0977" -> [150, ..., 300, 412, 977].
+    # Діапазони включно, порядок як у рядку, повтори пропускаються
+    text = re.sub(r"\s*[-–—]\s*", "-", text.strip())
+    numbers = []
+    seen = set()
+    for part in re.split(r"[,;\s]+", text):
+        if not part:
+            continue
+        match = re.fullmatch(r"(\d+)(?:-(\d+))?", part)
+        if not match:
+            raise ValueError(f"Невірний номер або діапазон: '{part}'")
+        first, last = int(match[1]), int(match[2] or match[1])
+        if last < first:
+            raise ValueError(f"Діапазон '{part}' має починатися з меншого номера")
+        for number in range(first, last + 1):
+            if number not in seen:
+                seen.add(number)
+                numbers.append(number)
+    if not numbers:
+        raise ValueError("Не вказано жодного номера")
+    return numbers
+
+
+def format_serial_selection(numbers, max_length=40):
+    # Зворотне до parse_serial_selection: сусідні номери згортаються в діапазони, для назви файлу
+    parts = []
+    start = previous = None
+    for number in list(numbers) + [None]:
+        if start is not None and number == previous + 1:
+            previous = number
+            continue
+        if start is not None:
+            parts.append(f"{start:04}" if start == previous else f"{start:04}-{previous:04}")
+        start = previous = number
+    label = ",".join(parts)
+    if len(label) > max_length:
+        label = label[:label.rfind(",", 0, max_length)] + ",..."
+    return label
+
+
+def reprint_output_name(short_prefix, nominal, date_code, numbers):
+    # Для одного номера - як раніше у "Згенерувати 1 стікер": "... #0412-1шт.pdf"
+    return f"{short_prefix} {nominal}A {date_code} #{format_serial_selection(numbers)}-{len(numbers)}шт.pdf"
+
+
+def box_output_name(seria, nominal, date_code, count):
+    return f"{seria} {nominal}A {date_code}-КОРОБКА-{count}шт.pdf"
+
+
+def split_numbers(numbers, split_size):
+    # Номери партії по split_size на файл (режим розбиття на кілька PDF)
+    return [numbers[i:i + split_size] for i in range(0, len(numbers), split_size)]
+
+
+def box_split_name(seria, nominal, date_code, numbers):
+    # Файл розбитої партії коробок: numbers - порядкові номери коробок у партії
+    return f"{seria} {nominal}A {date_code}-КОРОБКА #{format_serial_selection(numbers)}-{len(numbers)}шт.pdf"
+
+
+def standard_fields(date_code, nominal, va, short_prefix, art_seria, add_3=False, va_cl_02=None, va_cl_05s=None,
+                    serial_number=None):
+    # Для шаблонів _special_1 у va передається VA (CL 0.2S)
+    return {
+        "serial_number": serial_number,
+        "date_code": date_code,
+        "nominal": nominal,
+        "va": va,
+        "short_prefix": short_prefix,
+        "va_cl_02": va_cl_02,
+        "va_cl_05s": va_cl_05s,
+        "art_seria": art_seria,
+        "add_3": add_3,
+    }
+
+
+def box_fields(date_code, nominal, seria, art_seria):
+    return {
+        "date_code": date_code,
+        "nominal": nominal,
+        "seria": seria,
+        "art_seria": art_seria,
+    }
+
+
+def special_box_fields(nominal, seria, year, week, add_3=False):
+    return {
+        "nominal": nominal,
+        "seria": seria,
+        "year": year,
+        "week": week,
+        "add_3": add_3,
+    }
@@ -0,0 +1,151 @@
+import argparse
+import multiprocessing
+import os
+import sys
+
+from sticker_profile import enable_profiling
+from sticker_catalog import BASE_DIR, DEFAULT_CHUNK_SIZE, SAVE_PROFILES, DEFAULT_SAVE_PROFILE, RASTER_FORMATS, \
+    RASTER_MODES, DEFAULT_RASTER_DPI, DEFAULT_RASTER_MODE, scan_templates, configure_logging
+from sticker_engine import GenerationCancelled, refresh_plan_index
+from sticker_batch import TEXT_FIELDS, normalize_order, load_manifest, run_order, run_manifest
+
+# Генерація стікерів без графічного інтерфейсу (Qt тут не імпортується), наприклад:
+#   python sticker_cli.py standard --template "TAS 84 1000SE" --prefix 241800 --series TAS84 --nominal 1000 \
+#       --va 10 --year 24 --week 18 --count 500 --output out
+#   python sticker_cli.py box --template "TAS 65_box_special_1" --series TAS65 --nominal 600 --year 24 --week 18 \
+#       --count 20 --output out
+#   python sticker_cli.py batch --manifest orders.csv --output out
+#   python sticker_cli.py standard ... --serials "0150-0300,0412,0977" --append-to "out/TAS84 1000A 24W18-500шт.pdf"
+#   python sticker_cli.py standard ... --format png --dpi 203 --raster-mode mono   # растри для етикеткового принтера
+#   python sticker_cli.py standard ... --count 5000 --split 250 --workers 4   # 20 файлів по 250 стікерів
+#   python sticker_cli.py standard ... --format zpl --dpi 203   # команди ZPL для принтера Zebra
+
+
+def print_progress(done, total):
+    print(f"\r{done} з {total} стор.", end="", file=sys.stderr, flush=True)
+    if done == total:
+        print(file=sys.stderr)
+
+
+def order_from_args(args):
+    order = {name: getattr(args, name, "") for name in TEXT_FIELDS}
+    order.update(type=args.command, count=args.count, start=getattr(args, "start", 1), add_3=args.add_3)
+    return normalize_order(order, 1)
+
+
+def check_standard_args(parser, args):
+    # VA підставляється в шаблон як число; без нього генерація падала б глибоко в движку
+    if args.template.endswith(("_special_1", "_special_1.pdf")):
+        return
+    if not args.va.strip().isdigit():
+        parser.error(f"--va: для шаблону '{args.template}' потрібне число, напр. --va 10")
+
+
+def add_output_format_args(parser):
+    parser.add_argument("--split", type=int, metavar="N",
+                        help="Розбити партію на PDF по N стікерів (папка з назвою замовлення)")
+    parser.add_argument("--format", choices=["pdf"] + list(RASTER_FORMATS) + ["zpl"], default="pdf",
+                        help="pdf; png/tiff - по файлу на стікер у папці замовлення; zpl - команди для принтера Zebra")
+    parser.add_argument("--dpi", type=int, default=DEFAULT_RASTER_DPI, help="Роздільність растра або принтера ZPL")
+    parser.add_argument("--raster-mode", choices=RASTER_MODES, default=DEFAULT_RASTER_MODE,
+                        help="mono - 1 біт, gray - відтінки сірого")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Генерація PDF стікерів без графічного інтерфейсу")
+    parser.add_argument("--templates-dir", default=os.path.join(BASE_DIR, "templates"),
+                        help="Папка з шаблонами standard_*.pdf та box_*.pdf")
+    parser.add_argument("--profile", metavar="REPORT.json",
+                        help="Записати час і кількість викликів за фазами та правилами, а також знімки пам'яті")
+    parser.add_argument("--log-level", help="Рівень журналу: DEBUG, INFO, WARNING (за замовчуванням - змінна "
+                                              "STICKERMASTER_LOG або WARNING)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--template", required=True, help="Назва шаблону (як у програмі) або шлях до PDF")
+    common.add_argument("--series", required=True, help="Серія (короткий префікс), напр. TAS84")
+    common.add_argument("--art-series", default="", help="Серія для артикулу")
+    common.add_argument("--nominal", required=True, help="Номінал, напр. 1000")
+    common.add_argument("--year", required=True, help="Рік, напр. 24")
+    common.add_argument("--week", required=True, help="Тиждень, напр. 18")
+    common.add_argument("--count", type=int, help="Кількість стікерів (для стандартних - якщо не вказано --serials)")
+    common.add_argument("--add-3", action="store_true", help="Додати 3 в кінці артикула (як галочка в програмі)")
+    common.add_argument("--output", default=".", help="Папка для збереження")
+    common.add_argument("--quiet", action="store_true", help="Не показувати прогрес")
+    common.add_argument("--save-profile", choices=sorted(SAVE_PROFILES), default=DEFAULT_SAVE_PROFILE,
+                        help="fast - швидко, compact - найменший файл, balanced - між ними")
+    add_output_format_args(common)
+    common.add_argument("--workers", type=int, default=1,
+                        help="Кількість процесів (стандартна партія або файли режиму --split)")
+
+    standard = subparsers.add_parser("standard", parents=[common], help="Стандартні стікери з серійними номерами")
+    standard.add_argument("--prefix", required=True, help="Перші 6 цифр серійного номера, напр. 241800")
+    standard.add_argument("--start", type=int, default=1, help="Перший серійний номер")
+    standard.add_argument("--serials", default="", help="Передрук лише цих номерів, напр. \"0150-0300,0412,0977\"")
+    standard.add_argument("--append-to", default="", metavar="ORDER.pdf",
+                          help="Дописати сторінки в кінець існуючого PDF замовлення (інкрементне збереження)")
+    standard.add_argument("--va", default="", help="VA, число (обов'язково для шаблонів без _special_1)")
+    standard.add_argument("--va-cl-02s", default="", help="VA (CL 0.2S) для шаблонів _special_1")
+    standard.add_argument("--va-cl-02", default="", help="VA (CL 0.2) для шаблонів _special_1")
+    standard.add_argument("--va-cl-05s", default="", help="VA (CL 0.5S) для шаблонів _special_1")
+    standard.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                          help="Скільки стікерів тримати в пам'яті перед дописуванням у файл")
+
+    subparsers.add_parser("box", parents=[common], help="Етикетки для коробок")
+
+    batch = subparsers.add_parser("batch", help="Пакет замовлень з CSV або JSON (формат - у sticker_batch.py)")
+    batch.add_argument("--manifest", required=True, help="Файл маніфесту .csv або .json")
+    batch.add_argument("--output", default=".", help="Папка для збереження")
+    batch.add_argument("--quiet", action="store_true", help="Не показувати прогрес")
+    batch.add_argument("--save-profile", choices=sorted(SAVE_PROFILES), default=DEFAULT_SAVE_PROFILE,
+                       help="fast - швидко, compact - найменший файл, balanced - між ними")
+    add_output_format_args(batch)
+    batch.add_argument("--workers", type=int, default=1,
+                       help="Кількість процесів для стандартних партій і файлів --split")
+    batch.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE,
+                       help="Скільки стікерів тримати в пам'яті перед дописуванням у файл")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    if args.command == "standard":
+        check_standard_args(parser, args)
+    configure_logging(args.log_level)
+    if args.profile:
+        enable_profiling(args.profile)
+    try:
+        standard_templates, box_templates = scan_templates(args.templates_dir)
+    except FileNotFoundError:
+        raise SystemExit(f"Папка з шаблонами '{args.templates_dir}' не знайдена!")
+    # Індекс скомпільованих шаблонів: аналізуються лише нові та змінені PDF
+    refresh_plan_index(args.templates_dir)
+    os.makedirs(args.output, exist_ok=True)
+
+    progress = None if args.quiet else print_progress
+    output_format = None if args.format == "pdf" else args.format
+    try:
+        if args.command == "batch":
+            results = run_manifest(load_manifest(args.manifest), standard_templates, box_templates, args.output,
+                                   progress, args.workers, args.chunk_size, args.save_profile, output_format,
+                                   args.dpi, args.raster_mode, args.split,
+                                   log=lambda message: print(f"\r{message}"))
+            failed = [order for order, output_pdf, error in results if error]
+            print(f"Виконано {len(results) - len(failed)} з {len(results)} замовлень")
+            return 1 if failed else 0
+        output_pdf = run_order(order_from_args(args), standard_templates, box_templates, args.output, progress,
+                               args.workers, getattr(args, "chunk_size", DEFAULT_CHUNK_SIZE), args.save_profile,
+                               output_format, args.dpi, args.raster_mode, args.split)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    except (KeyboardInterrupt, GenerationCancelled):
+        print("Генерацію скасовано", file=sys.stderr)
+        return 1
+    print(output_pdf)
+    return 0
+
+
+if __name__ == "__main__":
+    multiprocessing.freeze_support()
+    sys.exit(main())
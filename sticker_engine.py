@@ -0,0 +1,906 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import fitz  # PyMuPDF
+from sticker_catalog import BASE_DIR, SAVE_PROFILES, DEFAULT_SAVE_PROFILE, KIND_STANDARD, KIND_BOX, KIND_SPECIAL_BOX, \
+    PLAN_INDEX_NAME, scan_templates, box_kind, load_plan_index, save_hash_index, cached_file_hash, part_file
+from sticker_profile import profiler
+
+logger = logging.getLogger("sticker_engine")
+
+FONT_MAPPING = {
+    "MyriadPro-Regular": "fonts/MyriadPro-Regular.ttf",
+    "MyriadPro-Bold": "fonts/MyriadPro-Bold.ttf",
+    "Arial-BoldMT": "fonts/arial-mt-bold.ttf",
+    "YVUNJSå¼«Arial-BoldMT": "fonts/4068-font.ttf",  #
+    "ArialMT": "fonts/ArialMT-Light.ttf",
+    "Bahnschrift": "fonts/bahnschrift.ttf",
+    "STGONDå¼«Bahnschrift": "fonts/bahnschrift.ttf",
+    "JIZLJBå¼«Bahnschrift": "fonts/bahnschrift.ttf",
+    "RHTNZFå¼«Bahnschrift": "fonts/bahnschrift.ttf",
+    "WHCMRVå¼«Bahnschrift": "fonts/bahnschrift.ttf",
+    "IMEGDXå¼«Bahnschrift": "fonts/bahnschrift.ttf",
+    "MyriadPro-SemiboldCond": "fonts/MyriadPro-SemiboldCond.otf",
+    "MyriadPro-BlackSemiExt": "fonts/Myriad Pro Black SemiExtended.otf",
+    "MyanmarText-Bold": "fonts/Myanmar Text Bold.TTF",
+    "MinionPro-Bold": "fonts/Minion Pro Bold.ttf",
+    "RJWHAAå¼«MyriadPro-Semib": "fonts/MyriadPro-SemiboldCond.otf",
+    "JFXDXWå¼«MyriadPro-Bold": "fonts/MyriadPro-Bold.ttf",
+    "LCJXNXå¼«MinionPro-Bold": "fonts/Minion Pro Bold.ttf",
+    "ZPRMHKå¼«MyriadPro-Regul": "fonts/MyriadPro-Regular.ttf",
+}
+
+def _resolve_font(font_name):
+    # Шляхи у FONT_MAPPING відносні до папки програми, а не до поточної робочої папки
+    font_path = FONT_MAPPING.get(font_name)
+    if font_path is None:
+        return None
+    return os.path.join(BASE_DIR, font_path)
+
+
+class Slot:
+    # Один span шаблону, який замінюється правилом `rule`
+    def __init__(self, rule, text, bbox, font_name, font_size, match=None):
+        self.rule = rule
+        self.text = text
+        self.bbox = tuple(bbox)
+        self.font_name = font_name
+        self.font_size = font_size
+        self.font_path = _resolve_font(font_name)
+        self.match = match  # (start, end, groups) результату re для правил, яким він потрібен
+
+
+class PagePlan:
+    def __init__(self, number, width, height):
+        self.number = number
+        self.width = width
+        self.height = height
+        self.slots = []
+
+
+class TemplatePlan:
+    # Скомпільований шаблон: відкритий PDF + список слотів на кожній сторінці
+    def __init__(self, path, kind, doc, mtime):
+        self.path = path
+        self.kind = kind
+        self.doc = doc
+        self.mtime = mtime
+        self.is_special = path.endswith("_special_1.pdf")
+        self.pages = []
+
+
+def nominal_letter(nominal):
+    # Літера і номінал для артикулу: B - до 100, C - 3-значний, D - 4-значний (+3)
+    local_nominal = nominal
+    letter = "B"
+    try:
+        nominal_int = int(nominal)  # Перетворюємо nominal на ціле число
+        if 100 <= nominal_int <= 999:  # Перевіряємо, чи nominal 3-значне
+            letter = "C"
+        elif 1000 <= nominal_int <= 9999:  # Перевіряємо, чи nominal 4-значне
+            letter = "D"
+            local_nominal = nominal_int + 3  # Обчислюємо local_nominal
+        else:
+            # Обробка ситуації, коли nominal не 3-значне і не 4-значне
+            logger.warning("nominal має бути 3- або 4-значним числом: %s", nominal)
+    except ValueError:
+        # Обробка помилки, якщо nominal не можна перетворити на ціле число
+        logger.warning("nominal має бути цілим числом: %r", nominal)
+    return letter, local_nominal
+
+
+# ---------------------------------------------------------------------------
+# Правила заміни. Кожне правило отримує слот і значення полів, а повертає
+# (список прямокутників для редагування, список (точка, текст) для вставки).
+# ---------------------------------------------------------------------------
+
+def _std_bbox(slot):
+    x0, y0, a, b = slot.bbox
+    return x0, y0 + 0.1, a, b
+
+
+def _std_serial(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    if fields["serial_number"] is None:
+        return [bbox], []
+    return [bbox], [((x0, y0 + slot.font_size), fields["serial_number"])]
+
+
+def _std_date(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    return [bbox], [((x0, y0 + slot.font_size), fields["date_code"])]
+
+
+def _std_ipr(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    return [bbox], [((x0, y0 + slot.font_size), f"Ipr {fields['nominal']}A")]
+
+
+def _std_ipr_wide(slot, fields):
+    # "Ipr " та "Ipr 600A": номінал може стояти окремим span-ом праворуч
+    x0, y0, a, b = _std_bbox(slot)
+    return [(x0, y0, a + 15, b)], [((x0, y0 + slot.font_size), f"Ipr {fields['nominal']}A")]
+
+
+def _std_article(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    letter, local_nominal = nominal_letter(fields["nominal"])
+    if letter == "D":
+        x0 -= 2
+    new_text = f"{fields['art_seria']}{letter}{local_nominal}SE"
+    if len(slot.text) < len(new_text):
+        x0 = x0 - ((len(new_text) - len(slot.text)) * 3)
+    elif len(slot.text) > len(new_text):
+        x0 = x0 + ((len(slot.text) - len(new_text)) * 3)
+    return [bbox], [((x0, y0 + slot.font_size), new_text)]
+
+
+def _std_seria(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    short_prefix = fields["short_prefix"]
+    if len(slot.text) < len(short_prefix):
+        x0 = x0 - ((len(short_prefix) - len(slot.text)) * 3)
+    elif len(slot.text) > len(short_prefix):
+        x0 = x0 + ((len(slot.text) - len(short_prefix)) * 3)
+    return [bbox], [((x0, y0 + slot.font_size), short_prefix)]
+
+
+def _std_combined(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    letter, local_nominal = nominal_letter(fields["nominal"])
+    new_text = f"{fields['art_seria']}{letter}{local_nominal}SE     {fields['short_prefix']}"
+    start, end, _ = slot.match
+    new_span_text = slot.text.replace(slot.text[start:end], new_text)
+    return [bbox], [((x0, y0 + slot.font_size), new_span_text)]
+
+
+def _std_special_article(slot, fields):
+    x0, y0, a, b = bbox = _std_bbox(slot)
+    letter, local_nominal = nominal_letter(fields["nominal"])
+    three = "3" if fields["add_3"] else ""
+    new_text = f"{fields['art_seria']}{letter}{local_nominal}{three}S+1,2/6KV      {fields['short_prefix']}"
+    return [bbox], [((x0, y0 + slot.font_size), new_text)]
+
+
+def _std_va_field(name):
+    def rule(slot, fields):
+        x0, y0, a, b = _std_bbox(slot)
+        return [(x0, y0 + 1, a, b)], [((x0, y0 + slot.font_size - 0.1), fields[name])]
+    return rule
+
+
+def _std_va_digit(slot, fields):
+    x0, y0, a, b = _std_bbox(slot)
+    va = fields["va"]
+    va_num = int(va)
+    minus = 0 if va_num < 9 else 2
+    return [(x0, y0 + 1, a, b)], [((x0 - minus, y0 + slot.font_size - 0.1), va)]
+
+
+def _box_date(slot, fields):
+    x0, y0, a, b = slot.bbox
+    return [(x0, y0, a - 1, b)], [((x0 - 1, y0 + slot.font_size), fields["date_code"])]
+
+
+def _box_nominal(slot, fields):
+    x0, y0, a, b = slot.bbox
+    extracted_nominal = slot.match[2][0]
+    new_span_text = slot.text.replace(extracted_nominal, fields["nominal"])
+    return [slot.bbox], [((x0, y0 + slot.font_size), new_span_text)]
+
+
+def _box_article(slot, fields):
+    x0, y0, a, b = slot.bbox
+    letter, local_nominal = nominal_letter(fields["nominal"])
+    new_text = f"{fields['art_seria']}{letter}{local_nominal}SE"
+    return [slot.bbox], [((x0, y0 + slot.font_size), new_text)]
+
+
+def _box_seria(slot, fields):
+    x0, y0, a, b = slot.bbox
+    x0 += 1
+    y0 += 1
+    return [(x0, y0, a - 1, b - 1)], [((x0 - 3, y0 + slot.font_size), fields["seria"])]
+
+
+def _box_date_article(slot, fields):
+    combined_x0, combined_y0, combined_x1, combined_y1 = slot.bbox
+    extracted_date, extracted_seria = slot.match[2]
+
+    date_width = len(extracted_date) * 3  # Приблизна ширина дати
+    seria_width = len(extracted_seria) * 3  # Приблизна ширина розділювача
+    seria_x0 = combined_x0 + date_width + 2
+
+    redactions = [
+        (combined_x0, combined_y0, combined_x0 + date_width - 0.2, combined_y1 - 0.3),
+        (seria_x0, combined_y0, seria_x0 + seria_width, combined_y1 - 0.3),  # Приблизна ширина для серії
+    ]
+    insertions = [
+        ((combined_x0 - 4, combined_y0 + slot.font_size), fields["date_code"]),
+        ((seria_x0 + 1, combined_y0 + slot.font_size), fields["seria"]),
+    ]
+    return redactions, insertions
+
+
+def _special_box_article(slot, fields):
+    x0, y0, a, b = slot.bbox
+    letter, local_nominal = nominal_letter(fields["nominal"])
+    if letter == "D":
+        x0 -= 2
+    three = "3" if fields["add_3"] else ""
+    return [(x0, y0, a - 1, b)], [((x0 + 1, y0 + slot.font_size),
+                                   f"{fields['seria']}{letter}{local_nominal}{three}S+0,8/1,2кВ")]
+
+
+def _special_box_erase(slot, fields):
+    x0, y0, a, b = slot.bbox
+    return [(x0, y0, a - 1, b)], []
+
+
+def _special_box_date(slot, fields):
+    x0, y0, a, b = slot.bbox
+    year, week = fields["year"], fields["week"]
+    x_minus = 11
+    if year == 11 and week == 11:
+        x_minus = 6
+    return [(x0, y0, a - 1, b)], [((x0 - x_minus, y0 + slot.font_size), f"{year}W{week}")]
+
+
+def _special_box_seria(slot, fields):
+    x0, y0, a, b = slot.bbox
+    return [(x0, y0, a - 1, b)], [((x0 - 9, y0 + slot.font_size), fields["seria"])]
+
+
+def _special_box_size(slot, fields):
+    x0, y0, a, b = slot.bbox
+    return [slot.bbox], [((x0, y0 + slot.font_size), "32x65mm ")]
+
+
+def _special_box_nominal(slot, fields):
+    x0, y0, a, b = slot.bbox
+    return [(x0, y0, a + 20, b)], [((x0 - 2, y0 + slot.font_size), f"{fields['nominal']}/5AM.L LUNGO")]
+
+
+RULES = {
+    "serial": _std_serial,
+    "date": _std_date,
+    "ipr": _std_ipr,
+    "d_ipr": _std_ipr_wide,
+    "blank_ipr": _std_ipr_wide,
+    "article": _std_article,
+    "seria": _std_seria,
+    "combined": _std_combined,
+    "special_article": _std_special_article,
+    "va_cl_02s": _std_va_field("va"),
+    "va_cl_02": _std_va_field("va_cl_02"),
+    "va_cl_05s": _std_va_field("va_cl_05s"),
+    "va": _std_va_field("va"),
+    "va_digit": _std_va_digit,
+    "box_date": _box_date,
+    "box_nominal": _box_nominal,
+    "box_article": _box_article,
+    "box_seria": _box_seria,
+    "box_date_article": _box_date_article,
+    "special_box_article": _special_box_article,
+    "special_box_erase": _special_box_erase,
+    "special_box_date": _special_box_date,
+    "special_box_seria": _special_box_seria,
+    "special_box_size": _special_box_size,
+    "special_box_nominal": _special_box_nominal,
+}
+
+# Шаблони пошуку: (правило, регулярний вираз, спосіб перевірки)
+STANDARD_PATTERNS = [
+    ("serial", r"^\s*\d{10}\s*$", "match"),  # Шаблон для серійного номера
+    ("date", r"\d{2}W\d{2}", "match"),  # Шаблон для року і тижня
+    ("ipr", r"Ipr\d+A", "match"),  # Шаблон для пошуку "Ipr"
+    ("d_ipr", r"Ipr $", "match"),  # Шаблон для пошуку "Ipr" перед числом
+    ("blank_ipr", r"Ipr \d+A", "match"),  # Шаблон для пошуку "Ipr "
+    ("article", r"^(TA|TT|TAS|TASS|TASO)\d+[C|B|D]\d+SE$", "fullmatch"),  # Шаблон для артикулу
+    ("seria", r"^(TA|TT|TAS|TASS|TASO)\d+B?$", "match"),  # Шаблон для серії
+    ("combined", r"^(TA|TT|TAS|TASS|TASO)\d+[C|B|D]\d+SE\s+(TA|TT|TAS|TASS|TASO)\d+B?", "search"),
+]
+
+STANDARD_SPECIAL_PATTERNS = [
+    ("special_article", r"TASL50C6003S\+1,2/6KV\s{6}TAS65", "fullmatch"),
+    ("va_cl_02s", r"^1$", "match"),
+    ("va_cl_02", r"^3$", "match"),
+    ("va_cl_05s", r"^5$", "match"),
+]
+
+STANDARD_VA_PATTERNS = [
+    ("va", r"^(15|10)$", "match"),
+    ("va_digit", r"^(5|3)$", "match"),
+]
+
+BOX_PATTERNS = [
+    ("box_date", r"\d{2}W\d{2}$", "match"),  # Шаблон для року і тижня
+    ("box_nominal", r"(\d{3,4})/5A", "search"),
+    ("box_article", r"(TA|TT|TAS|TASS|TASO)\d+[C|B|D]\d+SE", "fullmatch"),  # Шаблон для артикулу
+    ("box_seria", r"\s*(TA|TT|TAS|TASS|TASO)\d+B?$", "match"),
+    ("box_date_article", r"(\d{2}W\d{2})\s+(TAS\d+[A-Z]?[0-9]*)", "search"),
+]
+
+SPECIAL_BOX_PATTERNS = [
+    ("special_box_article", r"TASL50C6003S", "match"),
+    ("special_box_erase", r"21$", "match"),
+    ("special_box_erase", r"W$", "match"),
+    ("special_box_date", r"37$", "match"),
+    ("special_box_erase", r"T$", "match"),
+    ("special_box_erase", r"AS$", "match"),
+    ("special_box_seria", r"65$", "match"),
+    ("special_box_size", r"32x65mm 6$", "match"),
+    ("special_box_nominal", r"00/5AM.L$", "match"),
+]
+
+
+def _patterns_for(kind, is_special):
+    if kind == KIND_STANDARD:
+        if is_special:
+            return STANDARD_PATTERNS + STANDARD_SPECIAL_PATTERNS
+        return STANDARD_PATTERNS + STANDARD_VA_PATTERNS
+    if kind == KIND_BOX:
+        return BOX_PATTERNS
+    return SPECIAL_BOX_PATTERNS
+
+
+class SpanClassifier:
+    # Скомпільовані регулярні вирази одного типу шаблону; span отримує перше правило, що підійшло
+    def __init__(self, patterns):
+        self.tests = [(rule, getattr(re.compile(pattern), how)) for rule, pattern, how in patterns]
+
+    def classify(self, span_text):
+        for rule, test in self.tests:
+            found = test(span_text)
+            if not found:
+                continue
+            if rule == "box_nominal" and not 100 <= int(found.group(1)) <= 9999:
+                continue
+            return rule, (found.start(), found.end(), found.groups())
+        return None
+
+
+# Набори правил для кожного типу шаблону компілюються один раз при імпорті
+CLASSIFIERS = {
+    (kind, is_special): SpanClassifier(_patterns_for(kind, is_special))
+    for kind in (KIND_STANDARD, KIND_BOX, KIND_SPECIAL_BOX)
+    for is_special in (False, True)
+}
+
+# Відбиток правил пошуку для індексу скомпільованих шаблонів: зміна правил робить збережені плани
+# цього типу шаблону недійсними
+RULES_FINGERPRINTS = {
+    key: hashlib.sha1(json.dumps(_patterns_for(*key), ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+    for key in CLASSIFIERS
+}
+
+
+def compile_template(path, kind):
+    # Аналізуємо шаблон один раз: які span-и замінюються, їх bbox, шрифти та правила
+    with profiler.phase("open_template"):
+        doc = fitz.open(path)
+    plan = TemplatePlan(path, kind, doc, os.path.getmtime(path))
+    classifier = CLASSIFIERS[kind, plan.is_special]
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    for page in doc:
+        page_plan = PagePlan(page.number, page.rect.width, page.rect.height)
+        with profiler.phase("get_text"):
+            blocks = page.get_text("dict")["blocks"]
+        for block in blocks:
+            for line in block.get("lines", []):
+                for span in line.get("spans", []):
+                    span_text = span["text"]  # Поточний текст
+                    with profiler.phase("classify"):
+                        found = classifier.classify(span_text)
+                    profiler.count(f"match:{found[0]}" if found else "match:-")
+                    if debug:
+                        logger.debug("%s: %r -> %s", os.path.basename(path), span_text, found[0] if found else "-")
+                    if found:
+                        rule, match = found
+                        page_plan.slots.append(Slot(rule, span_text, span["bbox"], span["font"], span["size"], match))
+        plan.pages.append(page_plan)
+    return plan
+
+
+def plan_to_dict(plan):
+    return {
+        "kind": plan.kind,
+        "rules_fingerprint": RULES_FINGERPRINTS[plan.kind, plan.is_special],
+        "fonts": sorted({slot.font_name for page_plan in plan.pages for slot in page_plan.slots}),
+        "rules": sorted({slot.rule for page_plan in plan.pages for slot in page_plan.slots}),
+        "pages": [{
+            "width": page_plan.width,
+            "height": page_plan.height,
+            "slots": [{"rule": slot.rule, "text": slot.text, "bbox": slot.bbox, "font": slot.font_name,
+                       "size": slot.font_size, "match": slot.match} for slot in page_plan.slots],
+        } for page_plan in plan.pages],
+    }
+
+
+def plan_from_dict(path, kind, data):
+    # Шаблон з індексу: PDF лише відкривається, span-и не розбираються
+    with profiler.phase("open_template"):
+        doc = fitz.open(path)
+    plan = TemplatePlan(path, kind, doc, os.path.getmtime(path))
+    for number, page_data in enumerate(data["pages"]):
+        page_plan = PagePlan(number, page_data["width"], page_data["height"])
+        for slot in page_data["slots"]:
+            start, end, groups = slot["match"]
+            page_plan.slots.append(Slot(slot["rule"], slot["text"], slot["bbox"], slot["font"], slot["size"],
+                                        (start, end, tuple(groups))))
+        plan.pages.append(page_plan)
+    return plan
+
+
+_plan_cache = {}
+_plan_indexes = {}
+
+
+def _plan_index(templates_dir):
+    # Індекс кожної папки шаблонів читається з диска один раз на процес
+    index = _plan_indexes.get(templates_dir)
+    if index is None:
+        index = _plan_indexes[templates_dir] = load_plan_index(templates_dir)
+    return index
+
+
+def _lookup_plan(index, path, kind):
+    # Повертає (ключ плану в індексі, збережений план або None, чи оновився запис хешу файлу).
+    # Хеш перераховується лише при зміні mtime або розміру файлу
+    path = os.path.abspath(path)
+    file_entry = index["files"].get(path)
+    content_hash, _ = cached_file_hash(path, index["files"])
+    key = f"{content_hash}:{kind}"
+    data = index["plans"].get(key)
+    if data is not None and data["rules_fingerprint"] != RULES_FINGERPRINTS[kind, path.endswith("_special_1.pdf")]:
+        data = None
+    return key, data, index["files"][path] is not file_entry
+
+
+def _compile_into_index(index, key, path, kind):
+    plan = compile_template(path, kind)
+    index["plans"][key] = plan_to_dict(plan)
+    return plan
+
+
+def save_plan_index(templates_dir):
+    save_hash_index(os.path.join(templates_dir, PLAN_INDEX_NAME), _plan_index(templates_dir))
+
+
+def get_template_plan(path, kind):
+    # Повертає скомпільований шаблон: з кешу процесу, з індексу на диску (templates/.plans.json)
+    # або компілює і дописує в індекс; перекомпільовує, лише якщо змінився вміст файлу
+    mtime = os.path.getmtime(path)
+    key = (os.path.abspath(path), kind)
+    plan = _plan_cache.get(key)
+    if plan is None or plan.mtime != mtime:
+        if plan is not None:
+            plan.doc.close()
+        templates_dir = os.path.dirname(os.path.abspath(path))
+        index = _plan_index(templates_dir)
+        plan_key, data, changed = _lookup_plan(index, path, kind)
+        if data is None:
+            plan = _compile_into_index(index, plan_key, path, kind)
+            changed = True
+        else:
+            plan = plan_from_dict(path, kind, data)
+        if changed:
+            save_plan_index(templates_dir)
+        _plan_cache[key] = plan
+    return plan
+
+
+def forget_template_plan(path):
+    # Шаблон змінено або видалено: план прибирається з кешу процесу і наступного разу береться з індексу
+    # або компілюється. PDF не закривається явно - його ще може використовувати незавершена генерація
+    path = os.path.abspath(path)
+    for key in [key for key in _plan_cache if key[0] == path]:
+        del _plan_cache[key]
+
+
+def refresh_plan_index(templates_dir):
+    # Викликається при старті: компілює лише нові та змінені шаблони, прибирає з індексу видалені.
+    # Повертає назви файлів, які довелося скомпілювати
+    templates_dir = os.path.abspath(templates_dir)
+    index = _plan_index(templates_dir)
+    standard_templates, box_templates = scan_templates(templates_dir)
+    templates = [(path, KIND_STANDARD) for path in standard_templates.values()]
+    templates += [(path, box_kind(name)) for name, path in box_templates.items()]
+
+    compiled = []
+    changed = False
+    used_plans = set()
+    for path, kind in templates:
+        plan_key, data, file_changed = _lookup_plan(index, path, kind)
+        used_plans.add(plan_key)
+        changed = changed or file_changed
+        if data is None:
+            _compile_into_index(index, plan_key, path, kind).doc.close()
+            compiled.append(os.path.basename(path))
+            changed = True
+
+    paths = {path for path, kind in templates}
+    for path in [path for path in index["files"] if path not in paths]:
+        del index["files"][path]
+        changed = True
+    for key in [key for key in index["plans"] if key not in used_plans]:
+        del index["plans"][key]
+        changed = True
+    if changed:
+        save_plan_index(templates_dir)
+    return compiled
+
+
+_font_buffers = {}
+
+
+def _font_buffer(font_path):
+    # Файл шрифту читаємо з диска один раз на процес
+    buffer = _font_buffers.get(font_path)
+    if buffer is None:
+        with open(font_path, "rb") as f:
+            buffer = _font_buffers[font_path] = f.read()
+    return buffer
+
+
+def use_font(doc_output, page, slot):
+    # Кожен шрифт вбудовується в doc_output один раз; решта сторінок лише посилається
+    # на той самий об'єкт шрифту. Повертає назву ресурсу шрифту на сторінці.
+    if slot.font_path is None:
+        return slot.font_name
+    fonts = getattr(doc_output, "sticker_fonts", None)
+    if fonts is None:
+        fonts = doc_output.sticker_fonts = {}
+    entry = fonts.get(slot.font_path)
+    if entry is None:
+        # Назва ресурсу лише з ASCII, щоб на неї можна було послатися з інших сторінок
+        font_name = re.sub(r"[^A-Za-z0-9-]", "", slot.font_name)
+        xref = page.insert_font(fontname=font_name, fontbuffer=_font_buffer(slot.font_path))
+        fonts[slot.font_path] = entry = (font_name, xref, set())
+    font_name, xref, pages = entry
+    if page.xref not in pages:
+        # insert_font може повернути однойменний шрифт з Form XObject сторінки,
+        # тому посилання на рівні сторінки додаємо завжди
+        _link_font(doc_output, page.xref, font_name, xref)
+        pages.add(page.xref)
+    return font_name
+
+
+def _link_font(doc_output, page_xref, font_name, font_xref):
+    # Додаємо посилання на шрифт у /Resources/Font сторінки; обидва словники можуть бути
+    # як вбудованими, так і окремими об'єктами
+    owner, path = page_xref, "Resources"
+    kind, value = doc_output.xref_get_key(owner, path)
+    if kind == "xref":
+        owner, path = int(value.split()[0]), ""
+    path = f"{path}/Font" if path else "Font"
+    kind, value = doc_output.xref_get_key(owner, path)
+    if kind == "xref":
+        owner, path = int(value.split()[0]), ""
+    path = f"{path}/{font_name}" if path else font_name
+    doc_output.xref_set_key(owner, path, f"{font_xref} 0 R")
+
+
+def save_output(doc_output, output_pdf, save_profile=DEFAULT_SAVE_PROFILE):
+    # Зберігаємо документ з налаштуваннями профілю (SAVE_PROFILES): підмножина шрифтів,
+    # стиснення, злиття однакових об'єктів. Пишемо через part_file, щоб перерваний запис
+    # не залишав напівзаписаного PDF.
+    profile = SAVE_PROFILES[save_profile]
+    if profile["subset_fonts"]:
+        with profiler.phase("subset_fonts"):
+            doc_output.subset_fonts()
+    with part_file(output_pdf) as part_path, profiler.phase("save"):
+        doc_output.save(part_path, **profile["options"])
+
+
+def render_plan(plan, doc_output, fields, texts=None):
+    # Додає до doc_output сторінки шаблону з підставленими значеннями fields.
+    # Якщо передано список texts, новий текст не вставляється, а додається в нього як
+    # (номер сторінки, слот, точка, текст) - для виводу зі шрифтами принтера (ZPL)
+    for page_plan in plan.pages:
+        with profiler.phase("show_page"):
+            new_page = doc_output.new_page(width=page_plan.width, height=page_plan.height)
+            new_page.show_pdf_page(new_page.rect, plan.doc, page_plan.number)
+
+        # Спочатку збираємо всі редагування сторінки, потім застосовуємо їх одним проходом
+        # і лише після цього вставляємо новий текст
+        insertions = []
+        for slot in page_plan.slots:
+            with profiler.phase(f"rule:{slot.rule}"):
+                slot_redactions, slot_insertions = RULES[slot.rule](slot, fields)
+                for rect in slot_redactions:
+                    new_page.add_redact_annot(rect, fill=[255, 255, 255])
+            insertions.extend((slot, point, text) for point, text in slot_insertions)
+        if page_plan.slots:
+            with profiler.phase("apply_redactions"):
+                new_page.apply_redactions()
+
+        if texts is not None:
+            texts.extend((page_plan.number, slot, point, text) for slot, point, text in insertions)
+            continue
+        for slot, point, text in insertions:
+            _insert_text(doc_output, new_page, slot, point, text)
+
+
+def _insert_text(doc_output, page, slot, point, text):
+    with profiler.phase("font"):
+        font_name = use_font(doc_output, page, slot)
+    with profiler.phase("insert_text"):
+        page.insert_text(point, text, fontsize=slot.font_size, color=(0, 0, 0), fontname=font_name)
+
+
+def build_background(plan, fields):
+    # Сторінки шаблону з усіма замінами, крім серійного номера: його місце лише очищається
+    background = fitz.open()
+    render_plan(plan, background, dict(fields, serial_number=None))
+    return background
+
+
+def render_overlay(plan, background, doc_output, serial_number):
+    # Сторінка стікера = спільний Form XObject фону + текст серійного номера
+    fields = {"serial_number": serial_number}
+    for page_plan in plan.pages:
+        with profiler.phase("show_page"):
+            new_page = doc_output.new_page(width=page_plan.width, height=page_plan.height)
+            new_page.show_pdf_page(new_page.rect, background, page_plan.number)
+
+        for slot in page_plan.slots:
+            if slot.rule != "serial":
+                continue
+            for point, text in RULES["serial"](slot, fields)[1]:
+                _insert_text(doc_output, new_page, slot, point, text)
+
+
+def copy_pages(source, doc_output, count, progress=None):
+    # Додає count копій сторінок source; кожна копія лише посилається на спільний Form XObject
+    for i in range(count):
+        for page in source:
+            with profiler.phase("show_page"):
+                new_page = doc_output.new_page(width=page.rect.width, height=page.rect.height)
+                new_page.show_pdf_page(new_page.rect, source, page.number)
+        if progress is not None:
+            progress((i + 1) * len(source), count * len(source))
+
+
+class GenerationCancelled(Exception):
+    # Піднімається з progress-callback, щоб перервати генерацію без збереження файлу
+    pass
+
+
+def write_standard_run(plan, fields, serial_numbers, output_pdf, progress=None, chunk_size=None,
+                       save_profile=DEFAULT_SAVE_PROFILE, background=None):
+    # Партія стандартних стікерів: спільний фон + серійний номер на кожній сторінці.
+    # progress(done, total) викликається після кожного стікера (у сторінках).
+    # З chunk_size сторінки пишуться у файл частинами по chunk_size стікерів.
+    # background - готовий фон (build_background) для кількох файлів з тими самими полями; його закриває викликач
+    if chunk_size:
+        return _write_standard_run_chunked(plan, fields, serial_numbers, output_pdf, progress, chunk_size,
+                                           save_profile)
+
+    doc_output = fitz.open()  # Новий PDF документ для збереження всіх сторінок
+    own_background = background is None
+    if own_background:
+        background = build_background(plan, fields)
+    try:
+        total = len(serial_numbers) * len(plan.pages)
+        for i, serial_number in enumerate(serial_numbers, 1):
+            render_overlay(plan, background, doc_output, serial_number)
+            if progress is not None:
+                progress(i * len(plan.pages), total)
+
+        profiler.snapshot("standard run rendered")
+        # Зберегти фінальний PDF файл з усіма сторінками
+        save_output(doc_output, output_pdf, save_profile)
+    finally:
+        doc_output.close()
+        if own_background:
+            background.close()
+    profiler.snapshot("standard run saved")
+    return output_pdf
+
+
+FULL_SAVE_OPTIONS = ("garbage", "use_objstms")  # Налаштування профілю, недоступні для інкрементного запису
+
+
+def _append_part(part_path, chunk, first, save_profile=DEFAULT_SAVE_PROFILE):
+    # Перша частина створює файл, наступні дописуються інкрементним збереженням; файл ніколи не
+    # перезаписується повністю, тож пам'ять не залежить від довжини партії. Повні налаштування профілю
+    # діють лише на першу частину: злиття об'єктів (garbage) інкрементний запис не підтримує, а потоки
+    # об'єктів (use_objstms) змушують MuPDF завантажити весь файл. Тому довгі партії з профілями
+    # balanced і compact більші, ніж той самий файл, збережений одним записом (див. sticker_bench.py)
+    options = SAVE_PROFILES[save_profile]["options"]
+    if first:
+        chunk.save(part_path, **options)
+        return
+    with fitz.open(part_path) as doc_output:
+        doc_output.insert_pdf(chunk)
+        doc_output.save(part_path, incremental=True, encryption=fitz.PDF_ENCRYPT_KEEP,
+                        **{name: value for name, value in options.items() if name not in FULL_SAVE_OPTIONS})
+
+
+def _write_standard_run_chunked(plan, fields, serial_numbers, output_pdf, progress, chunk_size,
+                                save_profile=DEFAULT_SAVE_PROFILE):
+    # Кожна частина будується в окремому документі і дописується у файл інкрементним
+    # збереженням, тому в пам'яті одночасно лише одна частина
+    background = build_background(plan, fields)
+    total = len(serial_numbers) * len(plan.pages)
+    try:
+        with part_file(output_pdf) as part_path:
+            for start in range(0, len(serial_numbers), chunk_size):
+                chunk = fitz.open()
+                try:
+                    for serial_number in serial_numbers[start:start + chunk_size]:
+                        render_overlay(plan, background, chunk, serial_number)
+                    if SAVE_PROFILES[save_profile]["subset_fonts"]:
+                        with profiler.phase("subset_fonts"):
+                            chunk.subset_fonts()
+                    with profiler.phase("append_part"):
+                        _append_part(part_path, chunk, start == 0, save_profile)
+                finally:
+                    chunk.close()
+                profiler.snapshot(f"chunk {start // chunk_size + 1}")
+                if progress is not None:
+                    progress(min(start + chunk_size, len(serial_numbers)) * len(plan.pages), total)
+    finally:
+        background.close()
+    return output_pdf
+
+
+def append_standard_run(plan, fields, serial_numbers, order_pdf, progress=None, chunk_size=None,
+                        save_profile=DEFAULT_SAVE_PROFILE):
+    # Передрук: сторінки з номерами serial_numbers дописуються в кінець існуючого PDF замовлення
+    # інкрементним збереженням - старі сторінки не переписуються, у файл додаються лише нові об'єкти.
+    # Сторінки спершу генеруються в тимчасовий файл, тож скасування не залишає файл замовлення недописаним
+    with fitz.open(order_pdf) as doc_output:
+        if not doc_output.can_save_incrementally():
+            raise ValueError(f"До файлу '{os.path.basename(order_pdf)}' не можна дописати сторінки "
+                             f"(пошкоджений або зашифрований PDF)")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        reprint_pdf = os.path.join(temp_dir, "reprint.pdf")
+        write_standard_run(plan, fields, serial_numbers, reprint_pdf, progress, chunk_size,
+                           DEFAULT_SAVE_PROFILE if SAVE_PROFILES[save_profile]["subset_fonts"] else "fast")
+        with fitz.open(order_pdf) as doc_output, fitz.open(reprint_pdf) as reprint, profiler.phase("append_part"):
+            doc_output.insert_pdf(reprint)
+            doc_output.saveIncr()
+    return order_pdf
+
+
+def write_box_run(plan, fields, count, output_pdf, progress=None, save_profile=DEFAULT_SAVE_PROFILE):
+    # Партія коробок: етикетка будується один раз, решта - копії
+    doc_output = fitz.open()  # Новий PDF документ для збереження всіх сторінок
+    label = fitz.open()
+    try:
+        render_plan(plan, label, fields)
+        copy_pages(label, doc_output, count, progress)
+        profiler.snapshot("box run rendered")
+
+        # Зберегти фінальний PDF файл з усіма сторінками
+        save_output(doc_output, output_pdf, save_profile)
+    finally:
+        doc_output.close()
+        label.close()
+    profiler.snapshot("box run saved")
+    return output_pdf
+
+
+def process_pool(workers, initializer=None, initargs=()):
+    # Пул процесів генерації. Процеси запускаються через spawn, а не fork: інакше кожен успадкував би
+    # відкритий у головному процесі шаблон із _plan_cache разом з позицією у файлі, і читання PyMuPDF
+    # у різних процесах заважали б одне одному. Кожен процес відкриває шаблон сам
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
+
+
+def _write_standard_shard(template_path, fields, serial_numbers, shard_pdf, save_profile):
+    # Виконується в процесі пулу: шаблон компілюється один раз на процес.
+    # Частина - проміжний файл, тому з профілю береться лише підмножина шрифтів
+    plan = get_template_plan(template_path, KIND_STANDARD)
+    write_standard_run(plan, fields, serial_numbers, shard_pdf,
+                       save_profile=DEFAULT_SAVE_PROFILE if SAVE_PROFILES[save_profile]["subset_fonts"] else "fast")
+    # Заміри процесу пулу передаються в головний процес і додаються до його звіту
+    return len(serial_numbers) * len(plan.pages), profiler.take()
+
+
+def write_standard_run_parallel(template_path, fields, serial_numbers, output_pdf, workers, progress=None,
+                                shard_size=250, save_profile=DEFAULT_SAVE_PROFILE):
+    # Ділить серійні номери на частини по shard_size, генерує їх у workers процесах
+    # і зливає частини у вихідний файл у порядку номерів
+    plan = get_template_plan(template_path, KIND_STANDARD)
+    total = len(serial_numbers) * len(plan.pages)
+    shards = [serial_numbers[i:i + shard_size] for i in range(0, len(serial_numbers), shard_size)]
+
+    with tempfile.TemporaryDirectory() as shard_dir:
+        shard_paths = [os.path.join(shard_dir, f"{n:05}.pdf") for n in range(len(shards))]
+        pool = process_pool(workers)
+        try:
+            futures = [pool.submit(_write_standard_shard, template_path, fields, shard, shard_path, save_profile)
+                       for shard, shard_path in zip(shards, shard_paths)]
+            done = 0
+            for future in as_completed(futures):
+                pages, shard_profile = future.result()
+                profiler.merge(shard_profile)
+                done += pages
+                if progress is not None:
+                    progress(done, total)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        # Зливаємо частини по одній, не тримаючи весь результат у пам'яті
+        with part_file(output_pdf) as part_path:
+            for n, shard_path in enumerate(shard_paths):
+                with fitz.open(shard_path) as shard, profiler.phase("append_part"):
+                    _append_part(part_path, shard, n == 0, save_profile)
+    return output_pdf
+
+
+_split_background = {}
+
+
+def _write_split_file(template_path, kind, fields, item, output_pdf, save_profile):
+    # Один файл розбитої партії: item - серійні номери (стандартні) або кількість коробок.
+    # Фон однаковий для всіх файлів партії, тому в процесі тримається фон останньої партії
+    plan = get_template_plan(template_path, kind)
+    if kind == KIND_STANDARD:
+        key = (plan.path, plan.mtime, tuple(sorted(fields.items())))
+        background = _split_background.get(key)
+        if background is None:
+            for old in _split_background.values():
+                old.close()
+            _split_background.clear()
+            background = _split_background[key] = build_background(plan, fields)
+        write_standard_run(plan, fields, item, output_pdf, save_profile=save_profile, background=background)
+        return len(item) * len(plan.pages)
+    write_box_run(plan, fields, item, output_pdf, save_profile=save_profile)
+    return item * len(plan.pages)
+
+
+def _write_split_shard(template_path, kind, fields, item, output_pdf, save_profile):
+    # Виконується в процесі пулу; заміри передаються в головний процес, як у _write_standard_shard
+    return _write_split_file(template_path, kind, fields, item, output_pdf, save_profile), profiler.take()
+
+
+def write_split_run(kind, template_path, fields, files, workers=1, progress=None, save_profile=DEFAULT_SAVE_PROFILE):
+    # Партія, розбита на кілька PDF: files - список (серійні номери або кількість коробок, вихідний файл).
+    # Файли пишуться паралельно в workers процесах. Результат один на всю партію: файли спершу
+    # пишуться як .part і отримують свої назви лише після успіху всієї партії; при помилці чи
+    # скасуванні видаляються лише .part цього запуску, а файли попередніх запусків не чіпаються
+    plan = get_template_plan(template_path, kind)
+    total = sum(len(item) if kind == KIND_STANDARD else item for item, output_pdf in files) * len(plan.pages)
+    for folder in {os.path.dirname(output_pdf) for item, output_pdf in files}:
+        os.makedirs(folder, exist_ok=True)
+    workers = min(workers, len(files))
+    parts = [(item, output_pdf + ".part") for item, output_pdf in files]
+    done = 0
+    try:
+        if workers <= 1:
+            for item, part_path in parts:
+                done += _write_split_file(template_path, kind, fields, item, part_path, save_profile)
+                if progress is not None:
+                    progress(done, total)
+        else:
+            pool = process_pool(workers)
+            try:
+                futures = [pool.submit(_write_split_shard, template_path, kind, fields, item, part_path, save_profile)
+                           for item, part_path in parts]
+                for future in as_completed(futures):
+                    pages, shard_profile = future.result()
+                    profiler.merge(shard_profile)
+                    done += pages
+                    if progress is not None:
+                        progress(done, total)
+            finally:
+                pool.shutdown(wait=True, cancel_futures=True)
+    except BaseException:
+        for item, part_path in parts:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+        raise
+    for item, output_pdf in files:
+        os.replace(output_pdf + ".part", output_pdf)
+    return [output_pdf for item, output_pdf in files]
@@ -0,0 +1,167 @@
+import atexit
+import json
+import multiprocessing
+import os
+import sys
+import time
+
+# Профілювання генерації за фазами й правилами. Вмикається змінною середовища
+# STICKERMASTER_PROFILE=<файл.json> або прапорцем --profile у sticker_cli.py;
+# звіт записується в JSON при завершенні процесу. Вимкнений профайлер повертає
+# спільний порожній контекст, тож у робочому циклі коштує лише один виклик методу.
+
+PROFILE_ENV = "STICKERMASTER_PROFILE"
+
+
+def memory_usage_mb():
+    # Поточна і пікова пам'ять процесу (RSS), МБ; None, якщо ОС не дає цих даних
+    if sys.platform == "win32":
+        import ctypes
+        from ctypes import wintypes
+
+        class ProcessMemoryCounters(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                        ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                        ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                        ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                        ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t)]
+
+        counters = ProcessMemoryCounters()
+        counters.cb = ctypes.sizeof(counters)
+        process = ctypes.windll.kernel32.GetCurrentProcess()
+        if not ctypes.windll.psapi.GetProcessMemoryInfo(process, ctypes.byref(counters), counters.cb):
+            return None, None
+        return counters.WorkingSetSize / (1024 * 1024), counters.PeakWorkingSetSize / (1024 * 1024)
+
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak = peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024  # macOS - байти, Linux - КБ
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        current = None
+    return current, peak
+
+
+class _NullPhase:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = _NullPhase()
+
+
+class _Phase:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_time(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.report_path = None
+        self.dump_registered = False
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.phases = {}  # назва -> [кількість, сумарний час, найдовший виклик]
+        self.counters = {}
+        self.memory = []
+
+    def phase(self, name):
+        if not self.enabled:
+            return NULL_PHASE
+        return _Phase(self, name)
+
+    def add_time(self, name, seconds):
+        entry = self.phases.get(name)
+        if entry is None:
+            self.phases[name] = [1, seconds, seconds]
+        else:
+            entry[0] += 1
+            entry[1] += seconds
+            if seconds > entry[2]:
+                entry[2] = seconds
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def snapshot(self, label):
+        if self.enabled:
+            current, peak = memory_usage_mb()
+            self.memory.append({"label": label, "t": round(time.perf_counter() - self.started, 4),
+                                "rss_mb": current and round(current, 1), "peak_rss_mb": peak and round(peak, 1)})
+
+    def take(self):
+        # Заміри фаз і лічильники з обнуленням; None, якщо профілювання вимкнене
+        if not self.enabled:
+            return None
+        taken = {"phases": self.phases, "counters": self.counters}
+        self.phases, self.counters = {}, {}
+        return taken
+
+    def merge(self, taken):
+        if not self.enabled or not taken:
+            return
+        for name, (count, total, longest) in taken["phases"].items():
+            entry = self.phases.setdefault(name, [0, 0.0, 0.0])
+            entry[0] += count
+            entry[1] += total
+            entry[2] = max(entry[2], longest)
+        for name, n in taken["counters"].items():
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def report(self):
+        return {
+            "wall_s": round(time.perf_counter() - self.started, 4),
+            "phases": {
+                name: {"count": count, "total_s": round(total, 6), "avg_ms": round(total / count * 1000, 4),
+                       "max_ms": round(longest * 1000, 4)}
+                for name, (count, total, longest) in sorted(self.phases.items(), key=lambda item: -item[1][1])
+            },
+            "counters": dict(sorted(self.counters.items())),
+            "memory": self.memory,
+        }
+
+    def dump(self, path=None):
+        path = path or self.report_path
+        if not path:
+            return
+        self.snapshot("dump")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, ensure_ascii=False, indent=2)
+
+
+profiler = Profiler()
+
+
+def enable_profiling(report_path=None):
+    profiler.enabled = True
+    profiler.report_path = report_path
+    profiler.reset()
+    profiler.snapshot("start")
+    # Процеси паралельної генерації успадковують змінну середовища, але звіт пише лише головний процес
+    if report_path and multiprocessing.parent_process() is None and not profiler.dump_registered:
+        atexit.register(profiler.dump)
+        profiler.dump_registered = True
+
+
+if os.environ.get(PROFILE_ENV):
+    enable_profiling(os.environ[PROFILE_ENV])
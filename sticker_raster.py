@@ -0,0 +1,266 @@
+import os
+import struct
+import zlib
+from concurrent.futures import as_completed
+import fitz  # PyMuPDF
+from sticker_catalog import KIND_STANDARD, RASTER_FORMATS, DEFAULT_RASTER_DPI, DEFAULT_RASTER_MODE, part_file
+from sticker_engine import RULES, process_pool, get_template_plan, build_background, render_overlay, render_plan, \
+    _font_buffer
+from sticker_profile import profiler
+
+# Растровий експорт: кожен стікер - окремий PNG або TIFF (1 біт чи відтінки сірого) з заданим DPI.
+# Етикеткові принтери друкують готовий растр набагато швидше, ніж розбирають PDF.
+# Фон (усе, крім серійного номера) растеризується один раз на партію; для кожного стікера рендериться
+# лише область серійного номера і копіюється поверх копії фону (Pixmap.copy - операція над масивом
+# пікселів у MuPDF). Поріг і пакування в біти - bytes.translate та int(..., 2), без numpy.
+
+MONO_THRESHOLD = 128  # Пікселі, світліші за поріг, стають білими
+REGION_MARGIN = 1  # Запас навколо області номера, пунктів (згладжування країв літер)
+
+# Таблиці для bytes.translate: піксель сірого -> символ біта. У PNG/TIFF 1 - білий, у ZPL 1 - чорна точка
+_WHITE_BITS = bytes(ord("1") if value >= MONO_THRESHOLD else ord("0") for value in range(256))
+_BLACK_BITS = bytes(ord("0") if value >= MONO_THRESHOLD else ord("1") for value in range(256))
+_fonts = {}
+
+
+def _font(slot):
+    # fitz.Font для вимірювання тексту; шрифт без файлу в FONT_MAPPING міряємо стандартним
+    key = slot.font_path or "helv"
+    font = _fonts.get(key)
+    if font is None:
+        font = _fonts[key] = fitz.Font(fontbuffer=_font_buffer(slot.font_path)) if slot.font_path \
+            else fitz.Font("helv")
+    return font
+
+
+def serial_region(page_plan, serial_number):
+    # Прямокутник сторінки, який змінюється від стікера до стікера: очищене місце старого номера
+    # і новий текст; None, якщо на сторінці немає номера
+    region = None
+    for slot in page_plan.slots:
+        if slot.rule != "serial":
+            continue
+        redactions, insertions = RULES["serial"](slot, {"serial_number": serial_number})
+        font = _font(slot)
+        rects = [fitz.Rect(rect) for rect in redactions]
+        for (x, y), text in insertions:
+            rects.append(fitz.Rect(x, y - font.ascender * slot.font_size,
+                                   x + font.text_length(text, slot.font_size), y - font.descender * slot.font_size))
+        for rect in rects:
+            region = rect if region is None else region | rect
+    if region is None:
+        return None
+    margin = REGION_MARGIN
+    return (region + (-margin, -margin, margin, margin)) & fitz.Rect(0, 0, page_plan.width, page_plan.height)
+
+
+def _png_chunk(tag, data):
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+
+def encode_png(width, height, bit_depth, rows, dpi):
+    # PNG у відтінках сірого (1 або 8 біт), кожен рядок без фільтра; DPI - у блоці pHYs
+    pixels_per_meter = round(dpi / 0.0254)
+    return b"".join((
+        b"\x89PNG\r\n\x1a\n",
+        _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, bit_depth, 0, 0, 0, 0)),
+        _png_chunk(b"pHYs", struct.pack(">IIB", pixels_per_meter, pixels_per_meter, 1)),
+        _png_chunk(b"IDAT", zlib.compress(b"".join(b"\x00" + row for row in rows), 6)),
+        _png_chunk(b"IEND", b""),
+    ))
+
+
+def encode_tiff(width, height, bit_depth, rows, dpi):
+    # TIFF у відтінках сірого (1 або 8 біт), одна смуга зі стисненням Deflate (8), 0 - чорний
+    data = zlib.compress(b"".join(rows), 6)
+    tags = [
+        (256, 4, width),  # ImageWidth
+        (257, 4, height),  # ImageLength
+        (258, 3, bit_depth),  # BitsPerSample
+        (259, 3, 8),  # Compression: Deflate
+        (262, 3, 1),  # PhotometricInterpretation: BlackIsZero
+        (273, 4, 0),  # StripOffsets - заповнюється нижче
+        (277, 3, 1),  # SamplesPerPixel
+        (278, 4, height),  # RowsPerStrip
+        (279, 4, len(data)),  # StripByteCounts
+        (282, 5, 0),  # XResolution - зміщення дробу
+        (283, 5, 0),  # YResolution
+        (296, 3, 2),  # ResolutionUnit: дюйм
+    ]
+    ifd_size = 2 + 12 * len(tags) + 4
+    resolution_offset = 8 + ifd_size
+    data_offset = resolution_offset + 8
+    ifd = [struct.pack("<H", len(tags))]
+    for tag, field_type, value in tags:
+        if tag == 273:
+            value = data_offset
+        elif tag in (282, 283):
+            value = resolution_offset
+        packed = struct.pack("<HH", value, 0) if field_type == 3 else struct.pack("<I", value)
+        ifd.append(struct.pack("<HHI", tag, field_type, 1) + packed)
+    ifd.append(struct.pack("<I", 0))  # Наступного IFD немає
+    return b"".join([b"II*\x00", struct.pack("<I", 8)] + ifd + [struct.pack("<II", dpi, 1), data])
+
+
+ENCODERS = {"png": encode_png, "tiff": encode_tiff}
+
+
+def mono_rows(pix, black_is_one=False):
+    # Поріг і пакування рядків сірого Pixmap (stride == width): 8 пікселів -> 1 байт;
+    # рядок з '0'/'1' int(..., 2) перетворює за лінійний час. Доповнення рядка - білим
+    width = pix.width
+    row_bytes = (width + 7) // 8
+    padding = ("0" if black_is_one else "1") * (row_bytes * 8 - width)
+    bits = pix.samples.translate(_BLACK_BITS if black_is_one else _WHITE_BITS).decode("ascii")
+    return [int(bits[y * width:(y + 1) * width] + padding, 2).to_bytes(row_bytes, "big") for y in range(pix.height)]
+
+
+def encode_pixmap(pix, image_format, mode, dpi):
+    # pix - сірий Pixmap без альфа-каналу (stride == width)
+    width, height, samples = pix.width, pix.height, pix.samples
+    if mode == "mono":
+        rows = mono_rows(pix)
+        bit_depth = 1
+    else:
+        rows = [samples[y * width:(y + 1) * width] for y in range(height)]
+        bit_depth = 8
+    return ENCODERS[image_format](width, height, bit_depth, rows, dpi)
+
+
+def _write_file(path, data):
+    with part_file(path) as part_path, open(part_path, "wb") as f:
+        f.write(data)
+
+
+def image_name(label, page_number, page_count, image_format):
+    # Одна сторінка - "<номер>.png", кілька - "<номер>-<сторінка>.png"
+    suffix = f"-{page_number + 1}" if page_count > 1 else ""
+    return f"{label}{suffix}{RASTER_FORMATS[image_format]}"
+
+
+class RasterRenderer:
+    # Фон партії і растри його сторінок; backgrounds - готові растри фону з головного процесу
+    # у вигляді (ширина, висота, пікселі), щоб процеси пулу не растеризували фон повторно
+    def __init__(self, plan, fields, dpi, image_format, mode, backgrounds=None):
+        self.plan = plan
+        self.dpi = dpi
+        self.image_format = image_format
+        self.mode = mode
+        self.matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        self.background = build_background(plan, fields)
+        if backgrounds is None:
+            with profiler.phase("rasterize_background"):
+                self.backgrounds = [self.rasterize(page) for page in self.background]
+        else:
+            self.backgrounds = [fitz.Pixmap(fitz.csGRAY, width, height, samples, False)
+                                for width, height, samples in backgrounds]
+
+    def rasterize(self, page, clip=None):
+        return page.get_pixmap(matrix=self.matrix, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+
+    def background_samples(self):
+        return [(pix.width, pix.height, pix.samples) for pix in self.backgrounds]
+
+    def write_stickers(self, serial_numbers, output_dir):
+        # Пише растри стікерів serial_numbers; сторінки з номерами будуються в тимчасовому документі,
+        # де фон - спільний Form XObject, а растеризується лише область номера
+        scratch = fitz.open()
+        try:
+            for serial_number in serial_numbers:
+                first_page = len(scratch)
+                render_overlay(self.plan, self.background, scratch, serial_number)
+                for page_plan, background in zip(self.plan.pages, self.backgrounds):
+                    image = fitz.Pixmap(background, 0)  # Копія без альфа-каналу
+                    region = serial_region(page_plan, serial_number)
+                    if region is not None:
+                        with profiler.phase("rasterize_serial"):
+                            serial_pix = self.rasterize(scratch[first_page + page_plan.number], region)
+                        with profiler.phase("composite"):
+                            image.copy(serial_pix, serial_pix.irect)
+                    with profiler.phase("encode"):
+                        data = encode_pixmap(image, self.image_format, self.mode, self.dpi)
+                    with profiler.phase("write_image"):
+                        _write_file(os.path.join(output_dir, image_name(
+                            serial_number, page_plan.number, len(self.plan.pages), self.image_format)), data)
+        finally:
+            scratch.close()
+        return len(serial_numbers) * len(self.plan.pages)
+
+    def close(self):
+        self.background.close()
+
+
+_worker_renderer = None
+
+
+def _init_raster_worker(template_path, fields, dpi, image_format, mode, backgrounds):
+    global _worker_renderer
+    _worker_renderer = RasterRenderer(get_template_plan(template_path, KIND_STANDARD), fields, dpi, image_format,
+                                      mode, backgrounds)
+
+
+def _write_raster_shard(serial_numbers, output_dir):
+    # Виконується в процесі пулу; заміри передаються в головний процес, як у write_standard_run_parallel
+    return _worker_renderer.write_stickers(serial_numbers, output_dir), profiler.take()
+
+
+def write_standard_raster(template_path, fields, serial_numbers, output_dir, dpi=DEFAULT_RASTER_DPI,
+                          image_format="png", mode=DEFAULT_RASTER_MODE, workers=1, progress=None, shard_size=100):
+    # Растри партії стандартних стікерів у папку output_dir; з workers > 1 частини по shard_size
+    # номерів рендеряться в пулі процесів
+    plan = get_template_plan(template_path, KIND_STANDARD)
+    os.makedirs(output_dir, exist_ok=True)
+    total = len(serial_numbers) * len(plan.pages)
+    shards = [serial_numbers[i:i + shard_size] for i in range(0, len(serial_numbers), shard_size)]
+    renderer = RasterRenderer(plan, fields, dpi, image_format, mode)
+    try:
+        done = 0
+        if workers <= 1:
+            for shard in shards:
+                done += renderer.write_stickers(shard, output_dir)
+                if progress is not None:
+                    progress(done, total)
+            return output_dir
+
+        pool = process_pool(workers, initializer=_init_raster_worker,
+                            initargs=(template_path, fields, dpi, image_format, mode, renderer.background_samples()))
+        try:
+            futures = [pool.submit(_write_raster_shard, shard, output_dir) for shard in shards]
+            for future in as_completed(futures):
+                pages, shard_profile = future.result()
+                profiler.merge(shard_profile)
+                done += pages
+                if progress is not None:
+                    progress(done, total)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+    finally:
+        renderer.close()
+    return output_dir
+
+
+def write_box_raster(plan, fields, count, output_dir, dpi=DEFAULT_RASTER_DPI, image_format="png",
+                     mode=DEFAULT_RASTER_MODE, progress=None):
+    # Усі коробки однакові: етикетка растеризується й кодується один раз, далі лише запис файлів
+    os.makedirs(output_dir, exist_ok=True)
+    label = fitz.open()
+    try:
+        render_plan(plan, label, fields)
+        matrix = fitz.Matrix(dpi / 72, dpi / 72)
+        images = []
+        for page in label:
+            with profiler.phase("rasterize_background"):
+                pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+            with profiler.phase("encode"):
+                images.append(encode_pixmap(pix, image_format, mode, dpi))
+    finally:
+        label.close()
+
+    for i in range(1, count + 1):
+        for page_number, data in enumerate(images):
+            with profiler.phase("write_image"):
+                _write_file(os.path.join(output_dir, image_name(f"{i:04}", page_number, len(images), image_format)),
+                            data)
+        if progress is not None:
+            progress(i * len(images), count * len(images))
+    return output_dir
@@ -0,0 +1,134 @@
+import fitz  # PyMuPDF
+from sticker_catalog import DEFAULT_RASTER_DPI, part_file
+from sticker_engine import RULES, render_plan
+from sticker_raster import mono_rows
+from sticker_profile import profiler
+
+# Вивід у ZPL для термопринтерів Zebra: принтер отримує готові команди замість PDF,
+# який драйвер мав би растеризувати на комп'ютері.
+#   1. Статичний фон (шаблон без заміненого тексту) завантажується один раз як графіка ~DG.
+#   2. Етикетка зберігається в пам'яті принтера як формат ^DF: фон + замінені поля як текст
+#      шрифтом принтера у позиції й розмірі зі скомпільованого шаблону; серійний номер - поле ^FN1.
+#   3. Кожен стікер - виклик формату ^XF лише з серійним номером; коробки - один виклик з ^PQ.
+# Позиції й розмір шрифту переводяться з пунктів PDF у точки принтера за dpi.
+# Шрифт принтера задає PRINTER_FONT; для кирилиці (напр. "кВ" у _special_1) принтеру потрібен
+# Unicode-шрифт, тоді PRINTER_FONT можна замінити, напр., на "^A@N,{height},{height},E:TT0003M_.TTF".
+
+GRAPHIC_NAME = "R:SMBG{page}.GRF"  # R: - оперативна пам'ять принтера, не зберігається після вимкнення
+FORMAT_NAME = "R:SMLBL{page}.ZPL"
+SERIAL_FIELD = 1
+PRINTER_FONT = "^A0N,{height}"  # Масштабований шрифт 0, висота в точках
+
+
+def _dots(points, dpi):
+    return round(points * dpi / 72)
+
+
+def field_data(text):
+    # ^FH дозволяє записати службові символи ZPL (^ ~ _) шістнадцятковим кодом після "_"
+    escaped = "".join(f"_{ord(char):02X}" if char in "^~_" else char for char in text)
+    return f"^FH^FD{escaped}^FS"
+
+
+def graphic_command(name, pix):
+    # ~DG: загальна кількість байтів, байтів у рядку, рядки растра в шістнадцятковому вигляді (1 - чорна точка)
+    rows = mono_rows(pix, black_is_one=True)
+    row_bytes = len(rows[0]) if rows else 0
+    return f"~DG{name},{row_bytes * len(rows)},{row_bytes},{b''.join(rows).hex().upper()}\n"
+
+
+def text_command(slot, point, dpi):
+    # ^FT - початок базової лінії тексту, як точка вставки тексту в PDF
+    x, y = point
+    return f"^FT{_dots(x, dpi)},{_dots(y, dpi)}" + PRINTER_FONT.format(height=max(_dots(slot.font_size, dpi), 1))
+
+
+class ZplLabel:
+    # Фон і поля шаблону з підставленими fields; serial_number у fields має бути None -
+    # місце номера очищається на фоні, а сам номер стає змінним полем ^FN1
+    def __init__(self, plan, fields, dpi):
+        self.plan = plan
+        self.dpi = dpi
+        self.texts = []
+        self.background = fitz.open()
+        render_plan(plan, self.background, fields, self.texts)
+        self.serial_points = [[(slot, RULES["serial"](slot, {"serial_number": ""})[1][0][0])
+                               for slot in page_plan.slots if slot.rule == "serial"] for page_plan in plan.pages]
+
+    def setup(self):
+        # Команди, які надсилаються один раз: графіка фону і збережені формати етикеток
+        matrix = fitz.Matrix(self.dpi / 72, self.dpi / 72)
+        commands = []
+        for page in self.background:
+            with profiler.phase("rasterize_background"):
+                pix = page.get_pixmap(matrix=matrix, colorspace=fitz.csGRAY, alpha=False)
+            graphic = GRAPHIC_NAME.format(page=page.number + 1)
+            commands.append(graphic_command(graphic, pix))
+            label = [f"^XA^CI28^PW{pix.width}^LL{pix.height}^DF{FORMAT_NAME.format(page=page.number + 1)}^FS\n",
+                     f"^FO0,0^XG{graphic},1,1^FS\n"]
+            for page_number, slot, point, text in self.texts:
+                if page_number == page.number:
+                    label.append(f"{text_command(slot, point, self.dpi)}{field_data(text)}\n")
+            for slot, point in self.serial_points[page.number]:
+                label.append(f"{text_command(slot, point, self.dpi)}^FN{SERIAL_FIELD}^FS\n")
+            label.append("^XZ\n")
+            commands.append("".join(label))
+        return "".join(commands)
+
+    def sticker(self, serial_number=None, quantity=1):
+        # Виклик збережених форматів: лише змінні поля і кількість копій
+        commands = []
+        for page_plan in self.plan.pages:
+            command = f"^XA^XF{FORMAT_NAME.format(page=page_plan.number + 1)}^FS"
+            if serial_number is not None and self.serial_points[page_plan.number]:
+                command += f"^FN{SERIAL_FIELD}{field_data(serial_number)}"
+            if quantity > 1:
+                command += f"^PQ{quantity}"
+            commands.append(command + "^XZ\n")
+        return "".join(commands)
+
+    def close(self):
+        self.background.close()
+
+
+def _write_zpl(output_zpl, chunks):
+    # Як і для PDF: спершу тимчасовий файл, потім підміна
+    with part_file(output_zpl) as part_path, open(part_path, "w", encoding="utf-8", newline="\n") as f:
+        for chunk in chunks:
+            f.write(chunk)
+    return output_zpl
+
+
+def standard_zpl(plan, fields, serial_numbers, dpi=DEFAULT_RASTER_DPI, progress=None):
+    # Потік команд партії стандартних стікерів (генератор рядків)
+    label = ZplLabel(plan, dict(fields, serial_number=None), dpi)
+    try:
+        yield label.setup()
+        total = len(serial_numbers) * len(plan.pages)
+        for i, serial_number in enumerate(serial_numbers, 1):
+            yield label.sticker(serial_number)
+            if progress is not None:
+                progress(i * len(plan.pages), total)
+    finally:
+        label.close()
+
+
+def box_zpl(plan, fields, count, dpi=DEFAULT_RASTER_DPI, progress=None):
+    # Коробки однакові: одна етикетка і ^PQ з кількістю
+    label = ZplLabel(plan, fields, dpi)
+    try:
+        yield label.setup()
+        yield label.sticker(quantity=count)
+        if progress is not None:
+            progress(count * len(plan.pages), count * len(plan.pages))
+    finally:
+        label.close()
+
+
+def write_standard_zpl(plan, fields, serial_numbers, output_zpl, dpi=DEFAULT_RASTER_DPI, progress=None):
+    return _write_zpl(output_zpl, standard_zpl(plan, fields, serial_numbers, dpi, progress))
+
+
+def write_box_zpl(plan, fields, count, output_zpl, dpi=DEFAULT_RASTER_DPI, progress=None):
+    return _write_zpl(output_zpl, box_zpl(plan, fields, count, dpi, progress))
+